@@ -44,6 +44,7 @@ from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 import os
 import logging
+import multiprocessing
 import pandas as pd
 import sys
 from time import strftime
@@ -55,12 +56,13 @@ import tkinter
 import requests
 import json
 from datetime import datetime
-from tkinter.filedialog import askopenfilename
+from tkinter.filedialog import askopenfilename, askdirectory
 
 from src import (apple_report, huawei_report, report_builder, samsung_gallery_report,
                  ktx_snapshot_report, samsung_report, sony_report,
                  verify_archive, utils, about_window, help_window,
-                 save_dialog, image_delegate, pandas_model, android_recents_report)
+                 save_dialog, image_delegate, pandas_model, android_recents_report, evidence_hash,
+                 extract_archive)
 
 from src.utils import resource_path
 
@@ -148,16 +150,50 @@ class GUI(QMainWindow):
         self.filemenu = self.menuBar().addMenu("&File")
         self.filemenu.addAction('&Logs', lambda: open_log())
 
+        # optionally check archive members for corruption while the archive is verified
+        self.integrity_mode = verify_archive.integrity_off
+        integrity_menu = self.filemenu.addMenu('&Integrity Check')
+        integrity_group = QActionGroup(self)
+        for label, mode in [('&Off', verify_archive.integrity_off),
+                            ('&Parser Files Only', verify_archive.integrity_parser),
+                            ('&All Files', verify_archive.integrity_all)]:
+            action = integrity_menu.addAction(label)
+            action.setCheckable(True)
+            action.setChecked(mode == self.integrity_mode)
+            action.setData(mode)
+            integrity_group.addAction(action)
+        integrity_group.triggered.connect(self._set_integrity_mode)
+
+        # Samsung Gallery media can be read straight from the archive, keeping previews rather than every original
+        self.stream_originals = False
+        stream_action = self.filemenu.addAction('&Stream Samsung Originals')
+        stream_action.setCheckable(True)
+        stream_action.setChecked(self.stream_originals)
+        stream_action.toggled.connect(self._set_stream_originals)
+
         self.openmenu = self.menuBar().addMenu("&Open")
         for oem, fd in self.function_dict.items():
             self.openmenu.addAction('&{}'.format(oem), (lambda e=oem: self._get_archive_dialog(e)))
 
+        # an already extracted file system can be parsed in place
+        self.openfoldermenu = self.menuBar().addMenu("Open &Folder")
+        for oem, fd in self.function_dict.items():
+            self.openfoldermenu.addAction('&{}'.format(oem), (lambda e=oem: self._get_archive_dialog(e, folder=True)))
+
         self.aboutmenu = self.menuBar().addMenu("&About")
         self.aboutmenu.addAction('&Info', lambda: about_window.AboutMift().exec_())
 
         self.helpmenu = self.menuBar().addMenu("&Help")
         self.helpmenu.addAction('&Key', lambda: help_window.HelpDialog().exec_())
 
+    def _set_integrity_mode(self, action):
+        self.integrity_mode = action.data()
+        self.add_log('Integrity check: {}'.format(action.text().replace('&', '')))
+
+    def _set_stream_originals(self, checked):
+        self.stream_originals = checked
+        self.add_log('Stream Samsung originals: {}'.format('On' if checked else 'Off'))
+
     def _init_tabs(self):
         self.tabs = QTabWidget()
         self.tabs.setTabsClosable(True)
@@ -170,8 +206,18 @@ class GUI(QMainWindow):
 
     def _close_tab(self, index):
         tab = self.tabs.widget(index)
+        archive = getattr(tab, 'archive', None)
         tab.deleteLater()
         self.tabs.removeTab(index)
+        if archive and not self._archive_in_use(archive):
+            evidence_hash.stop(archive)
+
+    def _archive_in_use(self, archive, verifying=True):
+        # by an open tab or, unless verifying is False, by a verification still running
+        if any(getattr(self.tabs.widget(idx), 'archive', None) == archive for idx in range(self.tabs.count())):
+            return True
+        verify_thread = getattr(self, '_verify_archive_thread', None)
+        return bool(verifying and verify_thread and verify_thread.isRunning() and verify_thread.archive == archive)
 
     def build_function_dict(self):
         # Builds the functions and associated data for easy lookups
@@ -241,9 +287,12 @@ class GUI(QMainWindow):
         groupbox.setLayout(self.display_layout)
         return groupbox
 
-    def _get_archive_dialog(self, oem):
+    def _get_archive_dialog(self, oem, folder=False):
         tkinter.Tk().withdraw()  # PYQT5 dialog freezes when selecting large zips; tkinter does not
-        archive = askopenfilename(title=oem, initialdir=os.getcwd())
+        if folder:
+            archive = askdirectory(title=oem, initialdir=os.getcwd())
+        else:
+            archive = askopenfilename(title=oem, initialdir=os.getcwd())
         if archive:
             self._init_archive_verification(archive, self.function_dict[oem]['required'], oem)
 
@@ -256,6 +305,9 @@ class GUI(QMainWindow):
             for err in errors:
                 logging.error(err)
                 self.add_log(err)
+            # the finishing verification is the one that failed, so only open tabs keep the hash running
+            if not self._archive_in_use(archive, verifying=False) and evidence_hash.stop(archive):
+                self.add_log('Stopped calculating the hash of {}'.format(basename(archive)))
         else:
             self.add_log('Verified successfully. Analysing files...')
             temp_out = utils.refresh_temp_dir()  # Create a fresh temp directory
@@ -265,7 +317,12 @@ class GUI(QMainWindow):
             self.tabs.addTab(DisplayTab(self, self.function_dict[oem]['func'], archive, temp_out, oem), oem)
 
     def _init_archive_verification(self, archive, required, oem):
-        self._verify_archive_thread = verify_archive.VerifyArchiveThread(self, archive, required, oem)
+        # the archive is hashed for the report while it is verified and parsed
+        if evidence_hash.start(archive):
+            self.add_log('Calculating MD5 and SHA-256 of {} in the background...'.format(basename(archive)))
+        self._verify_archive_thread = verify_archive.VerifyArchiveThread(
+            self, archive, required, oem, integrity=self.integrity_mode,
+            members=self.function_dict[oem]['func'].extract_members)
         self._verify_archive_thread.progressSignal.connect(self._progress_verification)
         self._verify_archive_thread.finishedSignal.connect(self._finished_verification)
         self._verify_archive_thread.setTerminationEnabled(True)
@@ -277,6 +334,7 @@ class DisplayTab(QWidget):
         super().__init__(parent=None)
         self.maingui, self.function, self.archive, self.temp_out, self.oem = args
         self.df = pd.DataFrame()
+        self._original_threads = set()
 
         self.progress_bar = QProgressBar()
         self.progress_bar.setMaximum(100)
@@ -340,6 +398,9 @@ class DisplayTab(QWidget):
 
                 column_icon = self.df.columns.values.tolist().index('Media')
                 self.tableview.setItemDelegateForColumn(column_icon, image_delegate.ImageDelegate(self.tableview))
+                if 'Original Member' in self.df.columns:
+                    # only previews were kept, double clicking a row extracts and opens its original
+                    self.tableview.doubleClicked.connect(self._open_original)
 
             else:
                 self.has_media = False
@@ -376,6 +437,24 @@ class DisplayTab(QWidget):
         self.proxy.setFilterRegExp(search)
         self.proxy.setFilterKeyColumn(-1)  # search all columns
 
+    def _open_original(self, index):
+        member = self.df.iloc[self.proxy.mapToSource(index).row()]['Original Member']
+        if not member:
+            return
+        self.maingui.add_log('Extracting {}...'.format(member))
+        # a compressed archive may take a while to reach the member, so it is extracted off the GUI thread
+        thread = extract_archive.ExtractMemberThread(self, member, pj(self.temp_out, 'originals'), self.archive)
+        thread.finishedSignal.connect(lambda original: self._original_extracted(thread, member, original))
+        self._original_threads.add(thread)
+        thread.start()
+
+    def _original_extracted(self, thread, member, original):
+        self._original_threads.discard(thread)
+        if original:
+            wb.open(original)
+        else:
+            self.maingui.add_log('[!!] Unable to extract {}'.format(member))
+
     def _thread_progress(self, i):
         self.progress_bar.setValue(i)
 
@@ -393,6 +472,7 @@ class DisplayTab(QWidget):
         rc = sd.exec_()
         if rc == 1:
             save_details = sd.get_value_dict()
+            save_details['evidence'] = self.archive
             self.maingui.add_log('Generating {} report...'.format(report_type))
 
             dt = '{}_{}'.format(strftime('%d%m%y'), strftime('%H%M%S'))
@@ -431,4 +511,6 @@ def main():
 
 
 if __name__ == '__main__':
+    # required for the process pools used during extraction when running as a frozen executable
+    multiprocessing.freeze_support()
     main()
@@ -36,7 +36,7 @@ import pandas as pd
 import shutil
 import xml.etree.ElementTree as ET
 
-from src import extract_archive, ktx_2_png
+from src import extract_archive, ktx_2_png, media_hashes
 from src.utils import resource_path, decode_bplist, build_dataframe
 
 # timedelta is cocoa UTC epoch - unix UTC epoch
@@ -46,6 +46,10 @@ delta = datetime(2001, 1, 1) - datetime(1970, 1, 1)
 class MakeRecentsReport(QThread):
     finishedSignal = pyqtSignal(object)
     progressSignal = pyqtSignal(list)
+    # only the recent task records and the snapshot of each task are needed, not everything beneath system_ce
+    extract_members = [
+        extract_archive.MemberPattern(r'(^|/)system_ce/\d+/recent_tasks/[^/]+_task\.xml$', within='system_ce'),
+        extract_archive.MemberPattern(r'(^|/)system_ce/\d+/snapshots/\d+\.jpg$', within='system_ce')]
 
     def __init__(self, *args):
         QThread.__init__(self, args[0])
@@ -95,10 +99,11 @@ class MakeRecentsReport(QThread):
         df = df[['media', 'Process Name', 'Task ID', 'Last Time Moved',
                  'Calling Package', 'Real Activity', 'User ID', 'UID']]
         df = df.fillna('')
+        df['MD5'], df['SHA-1'] = media_hashes.store(self.save_dir).columns(df['media'].tolist())
         return df
 
     def run(self):
-        extract_instance = extract_archive.ExtractArchive(self, ['system_ce'], self.save_dir, self.archive)
+        extract_instance = extract_archive.ExtractArchive(self, self.extract_members, self.save_dir, self.archive)
         out = extract_instance.extract()
         self.progressSignal.emit([100, out])
         recents_dict = self.get_metadata()
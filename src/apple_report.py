@@ -39,7 +39,7 @@ import base64
 from io import BytesIO
 import plistlib
 
-from src import extract_archive, ccl_bplist
+from src import extract_archive, ccl_bplist, perceptual_hash, media_hashes
 from src.utils import resource_path, decode_bplist, refresh_temp_dir, clean_path, dictionary_recursor, row_combiner
 
 
@@ -162,6 +162,8 @@ def get_address(row, col='Location_Lookup'):
 class MakeAppleReport(QThread):
     finishedSignal = pyqtSignal(object)
     progressSignal = pyqtSignal(list)
+    # the PhotoData directory is extracted whole, keeping its structure
+    extract_members = ['PhotoData']
 
     def __init__(self, *args):
         QThread.__init__(self, args[0])
@@ -173,7 +175,8 @@ class MakeAppleReport(QThread):
                                                           self.save_dir,
                                                           self.archive,
                                                           maintain_dir_structure=True,
-                                                          key_dir='PhotoData')
+                                                          key_dir='PhotoData',
+                                                          workers=os.cpu_count())
         out = extract_instance.extract()
         self.progressSignal.emit([100, out])
         
@@ -188,11 +191,17 @@ class MakeAppleReport(QThread):
             photos_df = self.combiner(photos_df)
             photos_df = self.drop_columns(photos_df)
 
+            photos_df['MD5'], photos_df['SHA-1'] = media_hashes.store(self.save_dir).columns(
+                photos_df['media'].tolist())
             reordered_cols = ['media']
             reordered_cols.extend(combiner_dict.keys())
+            reordered_cols.extend(['MD5', 'SHA-1'])
             photos_df = photos_df[reordered_cols]
             # Drop duplicate columns
             photos_df = photos_df.loc[:, ~photos_df.columns.duplicated()].copy()
+            self.progressSignal.emit([0, 'Grouping similar images...'])
+            photos_df['Similar Group'] = perceptual_hash.similar_groups(
+                photos_df['media'].tolist(), progress=perceptual_hash.progress_reporter(self.progressSignal))
             self.finishedSignal.emit(photos_df)
         else:
             self.finishedSignal.emit(pd.DataFrame())
@@ -257,6 +266,7 @@ class MakeAppleReport(QThread):
 
     def thumbnail_path(self, photos_df, photodata_dir, thumbnail_fn):
         thumbnail_col = list()
+        hashes = media_hashes.store(self.save_dir)
         total_rows = len(photos_df.index)
         count = 0
         for row in photos_df.itertuples():
@@ -270,6 +280,10 @@ class MakeAppleReport(QThread):
             
             if isfile(thumbnail_path_absolute):
                 os.rename(thumbnail_path_absolute, renamed_thumb)
+                # carry the digests taken on extraction over to the renamed file
+                digests = hashes.get(thumbnail_path_absolute)
+                if digests:
+                    hashes.record(renamed_thumb, digests)
             else:
                 logging.error('Dump file is missing {}'.format(thumbnail_path_absolute))
 
@@ -0,0 +1,734 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import os
+import io
+import re
+import json
+import bisect
+import logging
+import hashlib
+import sqlite3
+import struct
+import posixpath
+import threading
+import contextlib
+import zipfile
+import tarfile
+import zlib
+from collections import OrderedDict
+from os.path import join as pj
+from os.path import abspath, getsize, getmtime, isfile, isdir
+
+from src.zip_directory import ZipDirectory
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None  # gzip-compressed tars are streamed from the start of the file on every open
+
+app_data_dir = os.getenv('APPDATA')
+
+# Uncompressed bytes between the inflate checkpoints of a gzip-compressed tar. A seek inflates at most this
+# much. Each checkpoint keeps a 32 KiB window, so the sidecar is about 1/512th of the uncompressed size.
+gz_checkpoint_spacing = 16 * 1024 * 1024
+_gz_index_lock = threading.Lock()
+_gz_saved_points = dict()
+
+# The number of archive indexes held in memory at once. Each open tab references one archive.
+max_cached_indexes = 4
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+_build_locks = dict()
+# tar scans stopped early by verification, resumed when the full index is needed
+_tar_scans = dict()
+
+
+def normalise_member(name):
+    # archive member names are compared without leading './' or '/' and without a trailing '/'
+    name = name.replace('\\', '/')
+    while name.startswith('./'):
+        name = name[2:]
+    return name.strip('/')
+
+
+def path_endswith(path, suffix):
+    # True if the suffix matches the trailing path components of path
+    return not suffix or path == suffix or path.endswith('/' + suffix)
+
+
+def substring_fallback(needle):
+    # A needle naming a single file or directory is matched on path components only. Parsers pass thousands
+    # of these (e.g. every gallery filename, many of them deleted), so a miss must not search every member.
+    # Multi-component needles are few, fixed by the parser, and keep the substring search when nothing matches.
+    return '/' in needle
+
+
+def glob_to_regex(glob):
+    # '*' and '?' match within a single path component and '**/' spans any number of directories.
+    # Like a needle, a glob matches the trailing components of a member path.
+    parts, pos = list(), 0
+    while pos < len(glob):
+        if glob.startswith('**/', pos):
+            parts.append('(?:.*/)?')
+            pos += 3
+        elif glob.startswith('**', pos):
+            parts.append('.*')
+            pos += 2
+        elif glob[pos] == '*':
+            parts.append('[^/]*')
+            pos += 1
+        elif glob[pos] == '?':
+            parts.append('[^/]')
+            pos += 1
+        else:
+            parts.append(re.escape(glob[pos]))
+            pos += 1
+    return '(?:^|/){}$'.format(''.join(parts))
+
+
+class MemberPattern:
+    '''
+    Selects members by a regular expression, or a glob when glob=True, for parsers that want
+    particular files rather than everything a plain needle would match.
+    The expression is searched against the normalised member path. within is a needle, as for
+    ArchiveIndex.find(), that narrows the members tried, so the whole archive is not searched.
+    '''
+    def __init__(self, pattern, within=None, glob=False):
+        self.pattern = pattern
+        self.within = normalise_member(within) if within else None
+        self.regex = re.compile(glob_to_regex(normalise_member(pattern)) if glob else pattern)
+
+    def __repr__(self):
+        return self.pattern
+
+    def matches(self, path):
+        if self.within and not member_matches(self.within, path):
+            return False
+        return bool(self.regex.search(path))
+
+
+def member_matches(needle, path):
+    # ArchiveIndex.find() for a single normalised member path, without the substring fallback
+    if isinstance(needle, MemberPattern):
+        return needle.matches(path)
+    if not needle:
+        return True
+    head, leaf = posixpath.split(needle)
+    if posixpath.basename(path).startswith(leaf) and path_endswith(posixpath.dirname(path), head):
+        return True
+    # beneath a directory whose path ends with the needle
+    return '/{}/'.format(needle) in '/{}'.format(path)
+
+
+class ArchiveIndex:
+    '''
+    Lookup structures over the members of a zip or tar archive, or the files within a folder.
+    The archive is listed once and the index is shared between verification and every
+    extraction made against it, so resolving a path costs a hash or bisect lookup rather
+    than a scan of every member.
+
+    A needle such as 'com.samsung.cmh/databases/cmh.db' matches on path component
+    boundaries: its leading components must be the trailing directories of a member and
+    its last component must begin the member's filename (so that cmh.db also returns
+    cmh.db-wal and cmh.db-journal). A needle that names a directory returns everything
+    beneath it. Needles of more than one component that match nothing structurally fall back
+    to a substring search, see substring_fallback().
+    '''
+    def __init__(self, archive, archive_type, infos):
+        self.archive = archive
+        self.archive_type = archive_type
+        self.infos = infos  # a ZipDirectory, a list of TarInfo, or (path, is directory) for a folder
+        self.paths = list()
+        self.is_dir = bytearray(len(infos))
+        self._basenames = dict()  # filename -> [member index]
+        self._dirs = dict()  # directory name -> [directory path]
+        self._dir_set = set()
+
+        if archive_type == 'zip':
+            entries = infos.entries()
+        elif archive_type == 'dir':
+            entries = infos
+        else:
+            entries = ((info.name, info.isdir()) for info in infos)
+
+        for idx, (name, is_dir) in enumerate(entries):
+            path = normalise_member(name)
+            self.paths.append(path)
+            self.is_dir[idx] = is_dir
+            self._basenames.setdefault(posixpath.basename(path), []).append(idx)
+            self._add_dirs(path if is_dir else posixpath.dirname(path))
+
+        self._basename_keys = sorted(self._basenames.keys())
+        self._order = sorted(range(len(self.paths)), key=self.paths.__getitem__)
+        self._sorted_paths = [self.paths[idx] for idx in self._order]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _add_dirs(self, dir_path):
+        # register a directory and any parents not yet seen, including those with no member of their own
+        while dir_path and dir_path not in self._dir_set:
+            self._dir_set.add(dir_path)
+            self._dirs.setdefault(posixpath.basename(dir_path), []).append(dir_path)
+            dir_path = posixpath.dirname(dir_path)
+
+    def _descendants(self, dir_path):
+        prefix = dir_path + '/'
+        pos = bisect.bisect_left(self._sorted_paths, prefix)
+        while pos < len(self._sorted_paths) and self._sorted_paths[pos].startswith(prefix):
+            yield self._order[pos]
+            pos += 1
+
+    def lookup(self, path):
+        # returns the index of the member at exactly this path, or None
+        path = normalise_member(path)
+        pos = bisect.bisect_left(self._sorted_paths, path)
+        if pos < len(self._sorted_paths) and self._sorted_paths[pos] == path:
+            return self._order[pos]
+        return None
+
+    def find(self, needle, include_dirs=False):
+        # returns the indexes of all members matching the needle, in archive order
+        if isinstance(needle, MemberPattern):
+            return self._find_pattern(needle, include_dirs)
+        needle = normalise_member(needle)
+        if not needle:
+            matches = set(range(len(self.paths)))
+        else:
+            head, leaf = posixpath.split(needle)
+            matches = set()
+
+            pos = bisect.bisect_left(self._basename_keys, leaf)
+            while pos < len(self._basename_keys) and self._basename_keys[pos].startswith(leaf):
+                for idx in self._basenames[self._basename_keys[pos]]:
+                    if path_endswith(posixpath.dirname(self.paths[idx]), head):
+                        matches.add(idx)
+                pos += 1
+
+            for dir_path in self._dirs.get(leaf, ()):
+                if path_endswith(dir_path, needle):
+                    matches.update(self._descendants(dir_path))
+
+            if not matches and needle not in self._dir_set and substring_fallback(needle):
+                matches = {idx for idx, path in enumerate(self.paths) if needle in path}
+
+        if not include_dirs:
+            matches = {idx for idx in matches if not self.is_dir[idx]}
+        return sorted(matches)
+
+    def _find_pattern(self, pattern, include_dirs):
+        candidates = self.find(pattern.within, include_dirs=True) if pattern.within else range(len(self.paths))
+        return [idx for idx in candidates
+                if (include_dirs or not self.is_dir[idx]) and pattern.regex.search(self.paths[idx])]
+
+    def contains(self, needle):
+        # True if any member, or any directory implied by a member path, matches the needle
+        if isinstance(needle, MemberPattern):
+            return bool(self._find_pattern(needle, include_dirs=True))
+        needle = normalise_member(needle)
+        head, leaf = posixpath.split(needle)
+        if any(path_endswith(dir_path, needle) for dir_path in self._dirs.get(leaf, ())):
+            return True
+        return bool(self.find(needle, include_dirs=True))
+
+
+class ZipMemberReader(io.RawIOBase):
+    '''
+    Reads a single stored or deflated zip member from its local header.
+    Only the member's offset, sizes and CRC-32 from the central directory are needed, so a worker can
+    read members from its own file handle without building a ZipFile. As with zipfile, a member whose
+    data does not match its CRC-32 or size raises BadZipFile once it has been read to the end.
+    '''
+    supported = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+    read_size = 256 * 1024
+
+    def __init__(self, fp, header_offset, compress_type, compress_size, crc=None, file_size=None):
+        super().__init__()
+        if compress_type not in self.supported:
+            raise NotImplementedError('compression method {} is not supported'.format(compress_type))
+        fp.seek(header_offset)
+        header = fp.read(30)
+        if len(header) != 30 or header[:4] != b'PK\x03\x04':
+            raise zipfile.BadZipFile('bad local file header at offset {}'.format(header_offset))
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        fp.seek(name_len + extra_len, 1)
+        self._fp = fp
+        self._header_offset = header_offset
+        self._remaining = compress_size
+        self._decomp = zlib.decompressobj(-15) if compress_type == zipfile.ZIP_DEFLATED else None
+        self._eof = False
+        self._pending = b''
+        self._expected = (crc, file_size)
+        self._checked = False
+        self.crc = 0
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = len(b)
+        if self._pending:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        elif self._decomp is None:
+            data = self._fp.read(min(size, self._remaining))
+            self._remaining -= len(data)
+        else:
+            data = b''
+            while not data and not self._eof:
+                chunk = self._decomp.unconsumed_tail
+                if not chunk:
+                    chunk = self._fp.read(min(self.read_size, self._remaining))
+                    self._remaining -= len(chunk)
+                    if not chunk:
+                        # input exhausted, anything zlib still holds is returned on later reads
+                        data = self._decomp.flush()
+                        data, self._pending = data[:size], data[size:]
+                        self._eof = True
+                        break
+                data = self._decomp.decompress(chunk, size)
+                self._eof = self._decomp.eof
+        b[:len(data)] = data
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        if not data and size:
+            self._check()
+        return len(data)
+
+    def _check(self):
+        if self._checked:
+            return
+        self._checked = True
+        crc, file_size = self._expected
+        if file_size is not None and self.size != file_size:
+            raise zipfile.BadZipFile('Bad size for member at offset {} (expected {}, read {})'.format(
+                self._header_offset, file_size, self.size))
+        if crc is not None and self.crc != crc:
+            raise zipfile.BadZipFile('Bad CRC-32 for member at offset {} (expected {:08x}, read {:08x})'.format(
+                self._header_offset, crc, self.crc))
+
+
+def zip_member_args(info):
+    # the arguments ZipMemberReader needs for a member, or None if it must be read through zipfile
+    if info.flag_bits & 0x1 or info.compress_type not in ZipMemberReader.supported:
+        return None
+    return info.header_offset, info.compress_type, info.compress_size, info.CRC, info.file_size
+
+
+def open_zip_member(fp, info):
+    # opens a member from the archive's file handle, without a ZipFile
+    reader_args = zip_member_args(info)
+    if reader_args:
+        return ZipMemberReader(fp, *reader_args)
+    if info.flag_bits & 0x1:
+        raise RuntimeError('File {} is encrypted, password required for extraction'.format(info.filename))
+    # other compression methods (bzip2, lzma) are read by zipfile's own member reader
+    fp.seek(info.header_offset)
+    header = fp.read(30)
+    if len(header) != 30 or header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile('bad local file header at offset {}'.format(info.header_offset))
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    fp.seek(name_len + extra_len, 1)
+    return zipfile.ZipExtFile(fp, 'rb', info)
+
+
+def archive_type(archive):
+    if isdir(archive):
+        return 'dir'
+    elif zipfile.is_zipfile(archive):
+        return 'zip'
+    elif tarfile.is_tarfile(archive):
+        return 'tar'
+    return None
+
+
+def tar_sidecar_path(archive, extension='tarindex'):
+    # Tar seek indexes are kept outside the temp directory so they survive restarts.
+    # They are named by the identity of the archive, so a modified archive is indexed again.
+    if not app_data_dir:
+        return None
+    identity = '{}|{}|{}'.format(*_cache_key(archive))
+    return pj(app_data_dir, 'CF_MIFT', 'index',
+              '{}.{}'.format(hashlib.sha1(identity.encode()).hexdigest(), extension))
+
+
+def is_gzip(archive):
+    with open(archive, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+def _open_indexed_gzip(archive, sidecar):
+    gz_obj = indexed_gzip.IndexedGzipFile(archive, spacing=gz_checkpoint_spacing, drop_handles=False)
+    if sidecar and isfile(sidecar):
+        try:
+            gz_obj.import_index(sidecar)
+        except Exception as err:
+            logging.error('Unable to load gzip index {}, rebuilding. {}'.format(sidecar, err))
+            gz_obj.close()
+            gz_obj = indexed_gzip.IndexedGzipFile(archive, spacing=gz_checkpoint_spacing, drop_handles=False)
+    # A handle that is read before its first seek never records checkpoints, and tarfile reads the first
+    # header straight away. The seek primes the index so checkpoints are taken as the archive is read.
+    gz_obj.seek(0)
+    return gz_obj
+
+
+def _save_gz_index(gz_obj, sidecar):
+    # several handles on one archive may be open at once. The sidecar is only replaced by one that covers more
+    points = sum(1 for _ in gz_obj.seek_points())
+    with _gz_index_lock:
+        if points <= _gz_saved_points.get(sidecar, 0):
+            return
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        partial = sidecar + '.part'
+        gz_obj.export_index(partial)
+        os.replace(partial, sidecar)
+        _gz_saved_points[sidecar] = points
+
+
+def tar_stream(archive):
+    # The uncompressed bytes of a tar as a seekable file, and whether a seek is cheap. Seeking backwards in
+    # a compressed stream, other than a gzip read through its inflate checkpoints, starts again from the top.
+    if indexed_gzip is not None and is_gzip(archive):
+        return _open_indexed_gzip(archive, tar_sidecar_path(archive, 'gzindex')), True
+    stream = tarfile.open(archive, 'r').fileobj
+    return stream, isinstance(stream, io.BufferedReader)
+
+
+@contextlib.contextmanager
+def open_tar(archive):
+    '''
+    Opens a tar archive for reading.
+    tarfile can only stream a gzip-compressed tar, so each seek to a member re-inflates from the start of the
+    file. When indexed_gzip is installed, inflate checkpoints are recorded as the archive is read and a seek
+    resumes from the nearest one. Checkpoints are kept in a sidecar, so later opens (another parser, a second
+    extraction phase or a restart) start with them.
+    '''
+    if indexed_gzip is None or not is_gzip(archive):
+        with tarfile.open(archive, 'r') as tar_obj:
+            yield tar_obj
+        return
+
+    sidecar = tar_sidecar_path(archive, 'gzindex')
+    gz_obj = _open_indexed_gzip(archive, sidecar)
+    try:
+        with tarfile.open(fileobj=gz_obj, mode='r:') as tar_obj:
+            yield tar_obj
+        if sidecar:
+            try:
+                _save_gz_index(gz_obj, sidecar)
+            except Exception as err:
+                logging.error('Unable to save gzip index {}. {}'.format(sidecar, err))
+    finally:
+        gz_obj.close()
+
+
+def save_tar_index(infos, sidecar):
+    os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+    partial = sidecar + '.part'
+    if isfile(partial):
+        os.remove(partial)
+    with sqlite3.connect(partial) as conn:
+        conn.execute('CREATE TABLE members (name TEXT, type BLOB, offset INTEGER, offset_data INTEGER, '
+                     'size INTEGER, linkname TEXT, sparse TEXT)')
+        conn.executemany('INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         ((info.name, info.type, info.offset, info.offset_data, info.size, info.linkname,
+                           json.dumps(info.sparse) if info.sparse else None) for info in infos))
+    conn.close()
+    # only a completely written index is ever renamed into place
+    os.replace(partial, sidecar)
+
+
+def load_tar_index(sidecar):
+    # rebuilds the TarInfo for each member. extractfile() only needs the data offset and size to seek to it
+    infos = list()
+    conn = sqlite3.connect('file:{}?mode=ro'.format(sidecar), uri=True)
+    try:
+        for name, typ, offset, offset_data, size, linkname, sparse in conn.execute(
+                'SELECT name, type, offset, offset_data, size, linkname, sparse FROM members ORDER BY rowid'):
+            info = tarfile.TarInfo(name)
+            info.type, info.offset, info.offset_data = typ, offset, offset_data
+            info.size, info.linkname = size, linkname or ''
+            if sparse:
+                info.sparse = [tuple(block) for block in json.loads(sparse)]
+            infos.append(info)
+    finally:
+        conn.close()
+    return infos
+
+
+class TarScan:
+    '''
+    A resumable walk over the headers of a tar archive.
+    Headers already read and the offset of the next header are kept, so a scan stopped early
+    (e.g. by verification once every required path is found) continues from where it stopped.
+    While a scan runs, other threads can follow() it and act on each member as it is read.
+    '''
+    notify_every = 256
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.infos = list()
+        self.offset = 0  # offset of the next unread header
+        self.complete = False
+        self.error = None
+        self._scan_lock = threading.Lock()
+        self._grown = threading.Condition()
+
+    def scan(self, until=None):
+        # reads headers until the end of the archive, or until until(info) returns True
+        with self._scan_lock:
+            if self.complete:
+                return
+            try:
+                self._scan(until)
+            except Exception as err:
+                self.error = err
+                raise
+            finally:
+                with self._grown:
+                    self._grown.notify_all()
+
+    def _scan(self, until):
+        with open_tar(self.archive) as tar_obj:
+            if self.infos:
+                # tarfile reads the first header on open, skip straight to the next unread one
+                tar_obj.firstmember = None
+                tar_obj.offset = self.offset
+            while True:
+                info = tar_obj.next()
+                if info is None:
+                    self.complete = True
+                    break
+                self.infos.append(info)
+                self.offset = tar_obj.offset
+                if len(self.infos) % self.notify_every == 0:
+                    with self._grown:
+                        self._grown.notify_all()
+                if until and until(info):
+                    break
+
+    def finish_from(self, infos):
+        # completes a scan whose archive was indexed another way (e.g. from a sidecar), so followers are released
+        with self._grown:
+            if not self.complete:
+                self.infos = list(infos)
+                self.complete = True
+            self._grown.notify_all()
+
+    def fail(self, err):
+        with self._grown:
+            if not self.complete and self.error is None:
+                self.error = err
+            self._grown.notify_all()
+
+    def follow(self):
+        # yields every member, those already read and then each new one as the scan reaches it
+        pos = 0
+        while True:
+            with self._grown:
+                while pos >= len(self.infos) and not self.complete and self.error is None:
+                    self._grown.wait(1)
+            if self.error is not None:
+                raise self.error
+            end = len(self.infos)
+            while pos < end:
+                yield self.infos[pos]
+                pos += 1
+            if self.complete and pos >= len(self.infos):
+                return
+
+
+def _build_tar_index(archive):
+    sidecar = tar_sidecar_path(archive)
+    if sidecar and isfile(sidecar):
+        try:
+            return ArchiveIndex(archive, 'tar', load_tar_index(sidecar))
+        except Exception as err:
+            logging.error('Unable to load tar index {}, rebuilding. {}'.format(sidecar, err))
+
+    with _index_cache_lock:
+        tar_scan = _tar_scans.get(_cache_key(archive)) or TarScan(archive)
+    tar_scan.scan()
+    if sidecar:
+        try:
+            save_tar_index(tar_scan.infos, sidecar)
+        except Exception as err:
+            logging.error('Unable to save tar index {}. {}'.format(sidecar, err))
+    index = ArchiveIndex(archive, 'tar', tar_scan.infos)
+    _unregister_scan(archive, tar_scan)
+    return index
+
+
+def _unregister_scan(archive, tar_scan):
+    with _index_cache_lock:
+        key = _cache_key(archive)
+        if _tar_scans.get(key) is tar_scan:
+            del _tar_scans[key]
+
+
+def walk_folder(folder):
+    # (relative path, is directory) for everything beneath a folder, in the form the index expects
+    entries = list()
+    for root, dirs, files in os.walk(folder):
+        rel_root = os.path.relpath(root, folder).replace(os.sep, '/')
+        rel_root = '' if rel_root == '.' else rel_root + '/'
+        entries.extend((rel_root + d, True) for d in dirs)
+        entries.extend((rel_root + f, False) for f in files)
+    return entries
+
+
+def build_index(archive):
+    typ = archive_type(archive)
+    if typ == 'dir':
+        return ArchiveIndex(archive, typ, walk_folder(archive))
+    elif typ == 'zip':
+        return ArchiveIndex(archive, typ, ZipDirectory(archive))
+    elif typ == 'tar':
+        return _build_tar_index(archive)
+    raise ValueError('Unrecognised file format: {}'.format(archive))
+
+
+def _cache_key(archive):
+    archive = abspath(archive)
+    return archive, getsize(archive), getmtime(archive)
+
+
+def get_index(archive):
+    # returns the shared index for an archive, building it on first use
+    key = _cache_key(archive)
+    with _index_cache_lock:
+        if key in _index_cache:
+            _index_cache.move_to_end(key)
+            return _index_cache[key]
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+
+    # only one thread builds a given archive's index. Others wait for it rather than build it again
+    with build_lock:
+        with _index_cache_lock:
+            if key in _index_cache:
+                return _index_cache[key]
+        index = build_index(archive)
+        with _index_cache_lock:
+            _index_cache[key] = index
+            _build_locks.pop(key, None)
+            while len(_index_cache) > max_cached_indexes:
+                _index_cache.popitem(last=False)
+        return index
+
+
+def pending_scan(archive):
+    # the tar scan still running in the background for this archive, if any
+    with _index_cache_lock:
+        return _tar_scans.get(_cache_key(archive))
+
+
+def complete_in_background(archive, tar_scan):
+    # finishes indexing a part-scanned tar while the caller carries on. Extraction follows the scan.
+    thread = threading.Thread(target=_complete_index, args=(archive, tar_scan), daemon=True)
+    thread.start()
+    return thread
+
+
+def _complete_index(archive, tar_scan):
+    # The index may already exist (built by another caller or loaded from a sidecar) without this scan
+    # having been read to the end. The scan is always completed from the index, or failed, so that an
+    # extraction following it is never left waiting.
+    try:
+        index = get_index(archive)
+        tar_scan.finish_from(index.infos)
+    except Exception as err:
+        logging.error('Unable to index {}. {}'.format(archive, err))
+        tar_scan.fail(err)
+    finally:
+        _unregister_scan(archive, tar_scan)
+
+
+def is_indexed(archive):
+    # True if a full index is held in memory or can be loaded from a sidecar
+    if _cache_key(archive) in _index_cache:
+        return True
+    sidecar = tar_sidecar_path(archive)
+    return bool(sidecar and isfile(sidecar))
+
+
+def find_required(archive, paths, progress=None):
+    '''
+    Returns the paths not present in the archive and the number of members examined.
+    Zip archives, and tars already indexed, are checked against the full index. Other tars are
+    read header by header and the walk stops as soon as every path has been found; the headers
+    read so far are kept and the walk resumes from there when the archive is next indexed.
+    progress(found, total, members_read) is called whenever a path is found.
+    '''
+    if archive_type(archive) != 'tar' or is_indexed(archive):
+        index = get_index(archive)
+        return [path for path in paths if not index.contains(path)], len(index)
+
+    needles = {path: normalise_member(path) for path in paths}
+    missing = dict(needles)
+    # One scan per archive. A second verification while the first is still reading follows its scan
+    # rather than starting another that nothing would complete.
+    with _index_cache_lock:
+        key = _cache_key(archive)
+        tar_scan = _tar_scans.get(key)
+        owner = tar_scan is None
+        if owner:
+            tar_scan = _tar_scans[key] = TarScan(archive)
+
+    def found_all(info):
+        # as ArchiveIndex.contains(), so a path found here is one extraction will find
+        member = normalise_member(info.name)
+        for path, needle in list(missing.items()):
+            if member_matches(needle, member) or (substring_fallback(needle) and needle in member):
+                del missing[path]
+                if progress:
+                    progress(len(needles) - len(missing), len(needles), len(tar_scan.infos))
+        return not missing
+
+    if not owner:
+        for info in tar_scan.follow():
+            if found_all(info):
+                break
+        return list(missing.keys()), len(tar_scan.infos)
+
+    try:
+        tar_scan.scan(until=found_all)
+    except Exception as err:
+        tar_scan.fail(err)
+        _unregister_scan(archive, tar_scan)
+        raise
+    if tar_scan.complete:
+        # the whole archive was read anyway, so index it now from the headers already in hand
+        try:
+            get_index(archive)
+        finally:
+            tar_scan.finish_from(tar_scan.infos)
+            _unregister_scan(archive, tar_scan)
+    else:
+        # keep reading the rest of the archive while the parser starts on what has been found
+        complete_in_background(archive, tar_scan)
+    return list(missing.keys()), len(tar_scan.infos)
@@ -0,0 +1,145 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import queue
+import hashlib
+import logging
+import threading
+from os.path import abspath, getsize, isfile
+
+# The input archive is read in chunks of this size, with up to read_ahead chunks queued for each digest
+chunk_size = 8 * 1024 * 1024
+read_ahead = 4
+
+_hashers = dict()
+_hashers_lock = threading.Lock()
+
+
+class EvidenceHasher:
+    '''
+    MD5 and SHA-256 of an input archive, computed in the background while it is verified and parsed,
+    so the evidence does not need a separate full read outside mift before it is opened.
+    One thread reads the archive ahead into a bounded queue for each digest, and each digest is
+    updated on its own thread. hashlib releases the GIL on large updates, so the two run side by side.
+    cancel() stops the read after the current chunk, e.g. when the archive fails verification.
+    '''
+    algorithms = ('md5', 'sha256')
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.size = getsize(archive)
+        self.hashed = 0
+        self.digests = dict()
+        self.error = None
+        self.cancelled = False
+        self._done = threading.Event()
+        self._queues = [queue.Queue(maxsize=read_ahead) for _ in self.algorithms]
+        self._threads = [threading.Thread(target=self._digest, args=(name, q), daemon=True)
+                         for name, q in zip(self.algorithms, self._queues)]
+        self._reader = threading.Thread(target=self._read, daemon=True)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        self._reader.start()
+        return self
+
+    def _read(self):
+        try:
+            with open(self.archive, 'rb') as f:
+                while not self.cancelled:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    for q in self._queues:
+                        q.put(chunk)
+                    self.hashed += len(chunk)
+        except Exception as err:
+            self.error = err
+            logging.error('Unable to hash {}. {}'.format(self.archive, err))
+        finally:
+            for q in self._queues:
+                q.put(None)
+            for thread in self._threads:
+                thread.join()
+            if self.cancelled:
+                logging.info('Stopped hashing {}'.format(self.archive))
+            elif not self.error:
+                logging.info('Evidence {}  MD5: {}  SHA-256: {}'.format(
+                    self.archive, self.digests['md5'], self.digests['sha256']))
+            self._done.set()
+
+    def _digest(self, name, q):
+        digest = hashlib.new(name)
+        while True:
+            chunk = q.get()
+            if chunk is None:
+                break
+            digest.update(chunk)
+        self.digests[name] = digest.hexdigest()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def percent(self):
+        return int(self.hashed / self.size * 100) if self.size else 100
+
+    def cancel(self):
+        self.cancelled = True
+
+    def wait(self, timeout=None):
+        # returns {'md5': ..., 'sha256': ...} once hashing completes, or None on timeout, error or cancellation
+        if not self._done.wait(timeout) or self.error or self.cancelled:
+            return None
+        return dict(self.digests)
+
+
+def start(archive):
+    # begins hashing an input archive, unless it is already being hashed. Folders are not hashed.
+    if not isfile(archive):
+        return None
+    key = abspath(archive)
+    with _hashers_lock:
+        hasher = _hashers.get(key)
+        if hasher is None or hasher.error or hasher.cancelled or hasher.size != getsize(archive):
+            hasher = _hashers[key] = EvidenceHasher(archive).start()
+    return hasher
+
+
+def get(archive):
+    with _hashers_lock:
+        return _hashers.get(abspath(archive))
+
+
+def stop(archive):
+    # cancels the hash of an archive that is no longer open, rather than read the rest of it for nothing
+    with _hashers_lock:
+        hasher = _hashers.pop(abspath(archive), None)
+    if hasher:
+        hasher.cancel()
+    return hasher
@@ -25,94 +25,529 @@ SOFTWARE.
 """
 
 from PyQt5.QtWidgets import QWidget
+from PyQt5.QtCore import pyqtSignal, QThread
 import os
 from os.path import join as pj
 from os.path import *
-import zipfile
-import tarfile
+import time
+import queue
 import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from src.utils import resource_path
+from src import archive_index, file_cache, media_hashes
+from src.archive_index import MemberPattern
+
+# Members are copied to disk in chunks of buffer_size, so memory use does not grow with the member size.
+# memory_limit caps the total buffer space held by a single extraction.
+default_buffer_size = 1024 * 1024
+default_memory_limit = 64 * 1024 * 1024
+# Parallel zip extraction hands members to workers in batches of roughly this many compressed bytes
+default_batch_bytes = 32 * 1024 * 1024
+# Buffers in flight between the inflate and write stages. More than a few gains little once the disk is busy.
+pipeline_depth = 8
+# seconds between throughput updates sent to the parser's progressSignal
+progress_interval = 5
+
+_worker_fp = None
+
+
+def _init_zip_worker(archive):
+    # each worker process reads members through its own handle on the archive
+    global _worker_fp
+    _worker_fp = open(archive, 'rb')
+
+
+def _extract_zip_batch(batch, buffer_size):
+    # Returns the (file, (md5, sha1)) of each member written, and any errors. A member that cannot be read,
+    # or fails its CRC check, is removed rather than left looking extracted (or put into the cache)
+    written, errors = list(), list()
+    buffer = memoryview(bytearray(buffer_size))
+    for reader_args, file in batch:
+        try:
+            digests = media_hashes.Digests()
+            with archive_index.ZipMemberReader(_worker_fp, *reader_args) as fmem, open(file, 'wb') as file_out:
+                ExtractArchive._stream_member(fmem, file_out, buffer, digests)
+            written.append((file, digests.hexdigests()))
+        except Exception as err:
+            errors.append('cant copy file: {}  |  {}'.format(file, str(err)))
+            if isfile(file):
+                os.remove(file)
+    return written, errors
+
+
+class Throughput:
+    # counts bytes written during an extraction and reports the rate every progress_interval seconds
+    def __init__(self, report=None):
+        self.report = report
+        self.written = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.written += count
+            now = time.monotonic()
+            if not self.report or now - self._last_report < progress_interval:
+                return
+            self._last_report = now
+        self.report(self.written, now - self.started, False)
+
+    def finish(self):
+        if self.report and self.written:
+            self.report(self.written, time.monotonic() - self.started, True)
+
+
+class WritePipeline:
+    '''
+    Members are inflated on the calling thread and written to disk by a writer thread, so decompressing the
+    next chunk overlaps the write of the last. Chunks pass between the stages in a fixed pool of buffers,
+    which bounds the memory held by the queue. The writer hashes each chunk as it writes it and passes the
+    digests of each complete file to record(name, (md5, sha1)).
+    '''
+    def __init__(self, buffer_size, buffer_count, throughput, record=None):
+        self.throughput = throughput
+        self.record = record
+        self.buffer_size = buffer_size
+        self.buffer_count = max(2, buffer_count)
+        self._allocated = 0  # buffers are allocated as needed, so small members do not fill the pool
+        self._free = queue.Queue()
+        self._work = queue.Queue()
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._work.put(None)
+        self._writer.join()
+
+    def stream(self, fmem, out, on_written=None, hash_as=None):
+        # on_written(out) is called by the writer once the file is complete. Its digests are recorded as hash_as
+        self._work.put(('open', out, hash_as))
+        while True:
+            buffer = self._next_buffer()
+            try:
+                read = fmem.readinto(buffer)
+            except Exception:
+                # the buffer goes back to the pool, or enough failed members would leave none to read into
+                self._free.put(buffer)
+                self._work.put(('abort', out, None))
+                raise
+            if not read:
+                self._free.put(buffer)
+                break
+            self._work.put(('data', buffer, read))
+        self._work.put(('close', out, on_written))
+
+    def call(self, func):
+        # runs func on the writer thread once everything queued before it has been written
+        self._work.put(('call', func, None))
+
+    def _next_buffer(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            if self._allocated < self.buffer_count:
+                self._allocated += 1
+                return memoryview(bytearray(self.buffer_size))
+            return self._free.get()
+
+    def _write(self):
+        file_out, current, digests, hash_as = None, None, None, None
+        while True:
+            item = self._work.get()
+            if item is None:
+                break
+            action, arg, extra = item
+            try:
+                if action == 'data':
+                    # file_out is None after a failed open or write. The rest of that member is discarded
+                    if file_out:
+                        file_out.write(arg[:extra])
+                        if digests:
+                            digests.update(arg[:extra])
+                        self.throughput.add(extra)
+                elif action == 'open':
+                    current, hash_as = arg, extra
+                    digests = media_hashes.Digests() if self.record and hash_as else None
+                    file_out = open(arg, 'wb')
+                elif action == 'call':
+                    arg()
+                elif file_out:
+                    file_out.close()
+                    file_out = None
+                    if action == 'abort':
+                        # the member could not be read to the end or failed its CRC check. Nothing is left behind
+                        # that would look extracted, be hashed or be put into the cache
+                        os.remove(arg)
+                    elif action == 'close':
+                        if digests:
+                            self.record(hash_as, digests.hexdigests())
+                        if extra:
+                            extra(arg)
+            except Exception as err:
+                logging.error('cant copy file: {}  |  {}'.format(current, str(err)))
+                if file_out:
+                    file_out.close()
+                    file_out = None
+            finally:
+                if action == 'data':
+                    self._free.put(arg)
+
+
+def size_balanced_batches(jobs, batch_bytes=default_batch_bytes):
+    # jobs are (reader_args, file) pairs. Largest members are batched and scheduled first, so a
+    # large video starts early on its own rather than queueing behind a worker's small files.
+    jobs = sorted(jobs, key=lambda job: job[0][2], reverse=True)
+    batches, batch, total = list(), list(), 0
+    for job in jobs:
+        batch.append(job)
+        total += job[0][2]
+        if total >= batch_bytes:
+            batches.append(batch)
+            batch, total = list(), 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class ExtractMemberThread(QThread):
+    '''
+    Extracts a single archive member off the GUI thread, for the user to open.
+    finishedSignal carries the path of the extracted file, or '' if it could not be extracted.
+    Opened files may be edited by their viewer, so they are written out rather than linked from the cache.
+    '''
+    finishedSignal = pyqtSignal(str)
+
+    def __init__(self, parent, member, save_dir, archive):
+        QThread.__init__(self, parent)
+        self.member, self.save_dir, self.archive = member, save_dir, archive
+
+    def run(self):
+        ExtractArchive(None, [self.member], self.save_dir, self.archive, use_cache=False, hash_outputs=False).extract()
+        original = pj(self.save_dir, basename(self.member))
+        self.finishedSignal.emit(original if isfile(original) else '')
 
 
 class ExtractArchive(QWidget):
-    def __init__(self, parent, files_to_extract, save_dir, archive, maintain_dir_structure=False, key_dir=None):
+    def __init__(self, parent, files_to_extract, save_dir, archive, maintain_dir_structure=False, key_dir=None,
+                 buffer_size=default_buffer_size, memory_limit=default_memory_limit, workers=1, use_cache=True,
+                 hash_outputs=True):
         super().__init__(parent=None)
+        self.parser = parent
         self.files_to_extract = files_to_extract
         self.save_dir = save_dir
         self.archive = archive
         self.maintain_dir_structure = maintain_dir_structure
         self.key_dir = key_dir
+        self.buffer_size = max(1, min(buffer_size, memory_limit))
+        self.memory_limit = memory_limit
+        # zip members can be read in any order, so they may be extracted by a pool of processes
+        self.workers = max(1, min(workers or 1, self.memory_limit // self.buffer_size))
+        # Members are kept in a cache that survives restarts, keyed by the archive's identity and the
+        # member path, so re-opening the same evidence does not extract the same files again
+        self.cache = file_cache.extraction_cache() if use_cache else None
+        self.archive_id = None
+        # MD5 and SHA-1 of each file written, see media_hashes. Only parsers' temp directories carry the
+        # sidecar; a report folder or a file opened by the user is left with just the files asked for
+        self.hashes = media_hashes.store(save_dir) if hash_outputs else None
+        self._outputs, self._hashed = set(), set()
 
     def extract(self):
         os.makedirs(self.save_dir, exist_ok=True)
-        if zipfile.is_zipfile(self.archive):
-            with zipfile.ZipFile(self.archive, 'r') as zip_obj:
-                archive_members = zip_obj.namelist()
-                if not self.maintain_dir_structure:
-                    for file_member in self.files_to_extract:  # get the index of the file in the archive members
-                        file_idxs = [i for i, archive_member in enumerate(archive_members)
-                                     if file_member in archive_member]
-                        if file_idxs:
-                            for idx in file_idxs:
-                                if len(basename(archive_members[idx])) != 0:
-                                    file = pj(self.save_dir, '{}'.format(basename(archive_members[idx])))
-                                    with open(file, 'wb') as file_out:
-                                        zip_fmem = zip_obj.read(archive_members[idx])
-                                        file_out.write(zip_fmem)
+        out = self._extract()
+        self._finish_hashes()
+        return out
+
+    def _record_hash(self, file, digests):
+        if self.hashes is None:
+            return
+        self.hashes.record(file, digests)
+        self._hashed.add(file)
+
+    def _finish_hashes(self):
+        if self.hashes is None:
+            return
+        # files that were linked rather than written (from the cache or an input folder) are hashed from disk
+        pending = [file for file in self._outputs - self._hashed if isfile(file)]
+        for file, digests in media_hashes.hash_files(pending).items():
+            self._record_hash(file, digests)
+        self.hashes.save()
+
+    def _extract(self):
+        if isdir(self.archive):
+            self._link_from_folder()
+            return 'Folder Processed'
+        if self.cache:
+            self.archive_id = file_cache.sampled_hash(self.archive)
+        self.throughput = Throughput(self._report_throughput)
+        tar_scan = archive_index.pending_scan(self.archive)
+        if tar_scan:
+            self._extract_following(tar_scan)
+        else:
+            # the index is shared with verification, so the archive is not listed again
+            index = archive_index.get_index(self.archive)
+            if index.archive_type == 'zip':
+                if self.workers > 1:
+                    self._extract_zip_parallel(index)
                 else:
-                    for archive_member in archive_members:
-                        if self.key_dir in archive_member:
-                            file = abspath(self.save_dir+'/{}'.format(archive_member))
-                            # make parent directories if they dont exist
-                            if archive_member.endswith('/'):
-                                # file is a folder
-                                try:
-                                    os.makedirs(file, exist_ok=True)
-                                except FileExistsError:
-                                    pass
-                            else:
-                                os.makedirs(dirname(file), exist_ok=True)
-                                try:
-                                    with open(file, 'wb') as file_out:
-                                        zip_fmem = zip_obj.read(archive_member)
-                                        file_out.write(zip_fmem)
-                                except Exception as err:
-                                    logging.error('cant copy file: {}  |  {}'.format(file, str(err)))
+                    with open(self.archive, 'rb') as zip_fp:
+                        self._extract_members(index, zip_fp, self._selected_members(index))
+            else:
+                with archive_index.open_tar(self.archive) as tar_obj:
+                    self._extract_members(index, tar_obj, self._selected_members(index))
+        # reported once every write, including those of a worker pool, has finished
+        self.throughput.finish()
+        return 'Archive Processed'
+
+    def stream(self):
+        '''
+        Yields (member path, open member) for each selected file without writing anything to disk, so a parser
+        can read media straight from the archive. Members are visited in archive order, each opened as it is
+        reached and closed once the caller moves on.
+        '''
+        index = archive_index.get_index(self.archive)
+        members = sorted({idx for idx, _ in self._selected_members(index) if not index.is_dir[idx]},
+                         key=lambda idx: self._member_offset(index, idx))
+        if index.archive_type == 'dir':
+            for idx in members:
+                with open(pj(self.archive, index.paths[idx]), 'rb') as fmem:
+                    yield index.paths[idx], fmem
+            return
+
+        opener = open(self.archive, 'rb') if index.archive_type == 'zip' else archive_index.open_tar(self.archive)
+        with opener as archive_obj:
+            for idx in members:
+                try:
+                    fmem = self._open_member(archive_obj, index, idx)
+                except Exception as err:
+                    logging.error('cant read file: {}  |  {}'.format(index.paths[idx], str(err)))
+                    continue
+                if fmem:
+                    with fmem:
+                        yield index.paths[idx], fmem
+
+    @staticmethod
+    def _member_offset(index, idx):
+        if index.archive_type == 'zip':
+            return index.infos[idx].header_offset
+        if index.archive_type == 'tar':
+            return index.infos[idx].offset
+        return idx
 
+    def _report_throughput(self, written, elapsed, finished):
+        signal = getattr(self.parser, 'progressSignal', None)
+        if signal is None:
+            return
+        rate = written / max(elapsed, 0.001) / (1024 * 1024)
+        if finished:
+            signal.emit([None, 'Extracted {:.1f} MB in {:.1f}s ({:.1f} MB/s)'.format(
+                written / (1024 * 1024), elapsed, rate)])
         else:
-            if not self.maintain_dir_structure:
-                with tarfile.open(self.archive, 'r') as tar_obj:
-                    archive_members = tar_obj.getnames()
-                    for file_member in self.files_to_extract:  # get the index of the file in the archive members
-                        file_idxs = [i for i, archive_member in enumerate(archive_members)
-                                     if file_member in archive_member]
-                        if file_idxs:
-                            for idx in file_idxs:
-                                if len(basename(archive_members[idx])) != 0:
-                                    file = pj(self.save_dir, '{}'.format(basename(archive_members[idx])))
-                                    with open(file, 'wb') as file_out:
-                                        tar_fmem = tar_obj.extractfile(archive_members[idx])
-                                        file_out.write(tar_fmem.read())
+            signal.emit([None, 'Extracting... {:.1f} MB written ({:.1f} MB/s)'.format(written / (1024 * 1024), rate)])
+
+    def _write_pipeline(self):
+        return WritePipeline(self.buffer_size, min(pipeline_depth, self.memory_limit // self.buffer_size),
+                             self.throughput, self._record_hash if self.hashes else None)
+
+    def _output_path(self, path):
+        if not self.maintain_dir_structure:
+            return pj(self.save_dir, '{}'.format(basename(path)))
+        return abspath(self.save_dir+'/{}'.format(path.replace(':', '')))
+
+    def _needles(self):
+        if self.maintain_dir_structure:
+            return [self.key_dir]
+        return self.files_to_extract
+
+    def _selected_members(self, index):
+        # yields the index of each wanted member and the path it is written to
+        for needle in self._needles():
+            for idx in index.find(needle, include_dirs=self.maintain_dir_structure):
+                yield idx, self._output_path(index.paths[idx])
+
+    def _link_from_folder(self):
+        # A folder input is not copied. Files are hard linked into the temp directory so parsers read them
+        # in place. SQLite databases, which parsers write to, and files on another volume are copied.
+        index = archive_index.get_index(self.archive)
+        for idx, file in self._selected_members(index):
+            try:
+                if index.is_dir[idx]:
+                    os.makedirs(file, exist_ok=True)
+                else:
+                    os.makedirs(dirname(file), exist_ok=True)
+                    file_cache.link_or_copy(pj(self.archive, index.paths[idx]), file)
+                    self._outputs.add(file)
+            except Exception as err:
+                logging.error('cant link file: {}  |  {}'.format(file, str(err)))
+
+    def _extract_following(self, tar_scan):
+        # Verification stopped part way through this tar and the rest of it is still being read in the
+        # background. Members are extracted as the scan reaches them rather than once it has finished.
+        needles = [needle if isinstance(needle, MemberPattern) else archive_index.normalise_member(needle)
+                   for needle in self._needles()]
+        fallback = [needle for needle in needles
+                    if isinstance(needle, str) and archive_index.substring_fallback(needle)]
+        matched, substring_only, links = set(), dict(), list()
+        with self._write_pipeline() as pipeline, archive_index.open_tar(self.archive) as tar_obj:
+            for info in tar_scan.follow():
+                if info.isdir() and not self.maintain_dir_structure:
+                    continue
+                path = archive_index.normalise_member(info.name)
+                hits = [needle for needle in needles if archive_index.member_matches(needle, path)]
+                if hits:
+                    matched.update(hits)
+                    self._extract_tar_info(tar_obj, info, path, pipeline, links)
+                else:
+                    # kept in case the needle never matches on path components, as ArchiveIndex.find()
+                    for needle in fallback:
+                        if needle not in matched and needle in path:
+                            substring_only.setdefault(needle, list()).append(info)
+
+            for needle, infos in substring_only.items():
+                if needle not in matched:
+                    for info in infos:
+                        self._extract_tar_info(tar_obj, info, archive_index.normalise_member(info.name),
+                                               pipeline, links)
+
+            if links:
+                # hard links are resolved once the scan is complete and the full index exists
+                index = archive_index.get_index(self.archive)
+                for info, file in links:
+                    idx = index.lookup(info.name)
+                    self._write_member(lambda: self._open_member(tar_obj, index, idx), False, file, pipeline,
+                                       index.paths[idx])
 
+    def _extract_tar_info(self, tar_obj, info, path, pipeline, links):
+        file = self._output_path(path)
+        if info.islnk():
+            links.append((info, file))
+        elif info.issym():
+            logging.info('skipping symbolic link: {}'.format(info.name))
+        else:
+            self._write_member(lambda: tar_obj.extractfile(info), info.isdir(), file, pipeline, path)
+
+    def _extract_zip_parallel(self, index):
+        wanted = dict()  # output path -> member index. Later members replace earlier ones of the same name
+        for idx, file in self._selected_members(index):
+            if index.is_dir[idx]:
+                os.makedirs(file, exist_ok=True)
+            else:
+                os.makedirs(dirname(file), exist_ok=True)
+                wanted[file] = idx
+                self._outputs.add(file)
+
+        jobs, unsupported = list(), list()
+        cache_parts = dict()  # cache part file written by a worker -> (cache key, output path)
+        for file, idx in wanted.items():
+            reader_args = archive_index.zip_member_args(index.infos[idx])
+            if not reader_args:
+                unsupported.append((idx, file))
+            elif not self.cache:
+                jobs.append((reader_args, file))
             else:
-                with tarfile.open(self.archive, 'r') as tar_obj:
-                    for member in tar_obj:
-                        if self.key_dir in member.name:
-                            file = self.save_dir+'/{}'.format(member.name.replace(':', ''))
-                            # make parent directories if they dont exist
-                            if member.isdir():
-                                # The member is a folder
-                                try:
-                                    os.makedirs(file, exist_ok=True)
-                                except FileExistsError:
-                                    pass
-                            try:
-                                os.makedirs(dirname(file), exist_ok=True)
-                                with open(file, 'wb') as file_out:
-                                    tar_fmem = tar_obj.extractfile(member)
-                                    file_out.write(tar_fmem.read())
-                            except Exception as err:
-                                logging.error('cant copy file: {}  |  {}'.format(file, str(err)))
-
-        return 'Archive Processed'
\ No newline at end of file
+                key = self.cache.key(self.archive_id, index.paths[idx])
+                cached = self.cache.get(key)
+                if cached:
+                    self._link_cache_hit(cached, file)
+                else:
+                    part = self.cache.part_path(key)
+                    cache_parts[part] = (key, file)
+                    jobs.append((reader_args, part))
+
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=file_cache.process_context,
+                                 initializer=_init_zip_worker, initargs=(self.archive,)) as pool:
+            futures = [pool.submit(_extract_zip_batch, batch, self.buffer_size)
+                       for batch in size_balanced_batches(jobs)]
+            # encrypted or unusually compressed members are extracted here while the pool works
+            with open(self.archive, 'rb') as zip_fp:
+                self._extract_members(index, zip_fp, unsupported)
+            for future in as_completed(futures):
+                written, errors = future.result()
+                for err in errors:
+                    logging.error(err)
+                for part, digests in written:
+                    self.throughput.add(getsize(part))
+                    if part in cache_parts:
+                        key, file = cache_parts[part]
+                        self._record_hash(file, digests)
+                        self._link_from_cache(self.cache.put(key, part), file)
+                    else:
+                        self._record_hash(part, digests)
+
+    def _extract_members(self, index, archive_obj, members):
+        with self._write_pipeline() as pipeline:
+            for idx, file in members:
+                self._write_member(lambda: self._open_member(archive_obj, index, idx), index.is_dir[idx], file,
+                                   pipeline, index.paths[idx])
+
+    def _write_member(self, open_member, is_dir, file, pipeline, path):
+        try:
+            # make parent directories if they dont exist
+            if is_dir:
+                os.makedirs(file, exist_ok=True)
+                return
+            os.makedirs(dirname(file), exist_ok=True)
+            self._outputs.add(file)
+            if self.cache:
+                key = self.cache.key(self.archive_id, path)
+                cached = self.cache.get(key)
+                if cached:
+                    # Linked in turn on the writer thread. An earlier member of the same name still queued there
+                    # would otherwise replace it, and in flat mode the last member of a name is the one kept.
+                    pipeline.call(lambda: self._link_cache_hit(cached, file))
+                    return
+            fmem = open_member()
+            if fmem:
+                with fmem:
+                    if self.cache:
+                        pipeline.stream(fmem, self.cache.part_path(key),
+                                        lambda part: self._link_from_cache(self.cache.put(key, part), file),
+                                        hash_as=file)
+                    else:
+                        pipeline.stream(fmem, file, hash_as=file)
+        except Exception as err:
+            logging.error('cant copy file: {}  |  {}'.format(file, str(err)))
+
+    def _link_cache_hit(self, cached, file):
+        # hashed from disk once extraction is done, replacing the digest of any earlier write
+        self._hashed.discard(file)
+        self._link_from_cache(cached, file)
+
+    @staticmethod
+    def _link_from_cache(cached, file):
+        try:
+            file_cache.link_or_copy(cached, file)
+        except Exception as err:
+            logging.error('cant copy file from cache: {}  |  {}'.format(file, str(err)))
+
+    @staticmethod
+    def _stream_member(fmem, file_out, buffer, digests=None):
+        while True:
+            read = fmem.readinto(buffer)
+            if not read:
+                break
+            file_out.write(buffer[:read])
+            if digests:
+                digests.update(buffer[:read])
+
+    @staticmethod
+    def _open_member(archive_obj, index, idx):
+        if index.archive_type == 'zip':
+            return archive_index.open_zip_member(archive_obj, index.infos[idx])
+
+        # Resolve hard links through the index. Left to tarfile, a link lookup lists every member again.
+        member = index.infos[idx]
+        if member.islnk():
+            target = index.lookup(member.linkname)
+            if target is None:
+                logging.error('cant resolve link: {} -> {}'.format(member.name, member.linkname))
+                return None
+            member = index.infos[target]
+        elif member.issym():
+            logging.info('skipping symbolic link: {}'.format(member.name))
+            return None
+        return archive_obj.extractfile(member)
@@ -0,0 +1,207 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+import multiprocessing
+from os.path import join as pj
+from os.path import getsize, getmtime, isfile, abspath
+
+app_data_dir = os.getenv('APPDATA')
+
+# Budget for files cached from extracted archives, see extraction_cache()
+extraction_cache_budget = 20 * 1024 * 1024 * 1024
+
+sample_count = 16
+sample_size = 64 * 1024
+
+_identities = dict()
+_shared_caches = dict()
+_shared_caches_lock = threading.Lock()
+
+# Worker processes are started with spawn on every platform, as they are on Windows. A forked worker would
+# inherit the shared caches' SQLite connections, which cannot be used across a fork, and any lock another
+# thread held at the time of the fork.
+process_context = multiprocessing.get_context('spawn')
+
+
+def sampled_hash(fp, include_mtime=True):
+    '''
+    Identifies a file by its size, modification time and a SHA-1 of evenly spaced samples of its content.
+    A 300 GB archive is identified from 1 MB of reads, where a full hash would read all of it.
+    Without include_mtime, copies of a file (media copied into a report, say) share its identity.
+    '''
+    fp = abspath(fp)
+    size, mtime = getsize(fp), getmtime(fp)
+    if (fp, size, mtime, include_mtime) in _identities:
+        return _identities[(fp, size, mtime, include_mtime)]
+
+    sha1 = hashlib.sha1('{}|{}'.format(size, mtime if include_mtime else '').encode())
+    with open(fp, 'rb') as f:
+        if size <= sample_count * sample_size:
+            sha1.update(f.read())
+        else:
+            step = (size - sample_size) // (sample_count - 1)
+            for i in range(sample_count):
+                f.seek(i * step)
+                sha1.update(f.read(sample_size))
+    _identities[(fp, size, mtime, include_mtime)] = sha1.hexdigest()
+    return _identities[(fp, size, mtime, include_mtime)]
+
+
+def is_modified_in_place(fp):
+    # parsers checkpoint SQLite databases and their journals, so these always get their own copy
+    if fp.endswith(('-wal', '-shm', '-journal')):
+        return True
+    with open(fp, 'rb') as f:
+        return f.read(16) == b'SQLite format 3\x00'
+
+
+def link_or_copy(src, dst):
+    # Hard links avoid a second copy of large media. Files that could be modified in place are copied
+    # so that changes never reach the source through the link.
+    if isfile(dst):
+        os.remove(dst)
+    if not is_modified_in_place(src):
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+class LRUFileCache:
+    '''
+    A directory of files held within a size budget.
+    A SQLite manifest records the size of each entry and when it was last used. Once the budget is
+    exceeded the least recently used entries are deleted. The running total is kept in the manifest and
+    updated in the same transaction as each entry, so processes sharing a cache keep within one budget.
+    '''
+    def __init__(self, cache_dir, budget):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(pj(self.cache_dir, 'manifest.db'), check_same_thread=False, timeout=30)
+        # the manifest can be rebuilt from use, so it is not worth a disk sync per entry
+        self._conn.execute('PRAGMA synchronous = OFF')
+        self._conn.execute('BEGIN IMMEDIATE')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_used REAL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS usage (total INTEGER)')
+        if self._conn.execute('SELECT total FROM usage').fetchone() is None:
+            self._conn.execute('INSERT INTO usage SELECT COALESCE(SUM(size), 0) FROM entries')
+        self._conn.commit()
+
+    @property
+    def total(self):
+        return self._conn.execute('SELECT total FROM usage').fetchone()[0]
+
+    def _add(self, size):
+        self._conn.execute('UPDATE usage SET total = total + ?', (size,))
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+    def entry_path(self, key):
+        return pj(self.cache_dir, key[:2], key)
+
+    def part_path(self, key):
+        # where a new entry is written before put() moves it into place
+        os.makedirs(pj(self.cache_dir, key[:2]), exist_ok=True)
+        return '{}.{}.{}.part'.format(self.entry_path(key), os.getpid(), threading.get_ident())
+
+    def get(self, key):
+        # returns the path of a cached entry, or None
+        path = self.entry_path(key)
+        with self._lock:
+            row = self._conn.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            if row and isfile(path):
+                self._conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+                self._conn.commit()
+                return path
+            elif row:
+                self._forget(key, row[0])
+        return None
+
+    def put(self, key, part_path):
+        # moves a completed part file into the cache and returns its final path
+        path = self.entry_path(key)
+        size = getsize(part_path)
+        os.replace(part_path, path)
+        with self._lock:
+            # an immediate transaction holds off puts from other processes until this one is accounted for
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+                self._conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (key, size, time.time()))
+                self._add(size - (row[0] if row else 0))
+                self._evict(keep=key)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return path
+
+    def _forget(self, key, size):
+        self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self._add(-size)
+        self._conn.commit()
+
+    def _evict(self, keep):
+        total = self.total
+        if total <= self.budget:
+            return
+        for key, size in self._conn.execute(
+                'SELECT key, size FROM entries WHERE key != ? ORDER BY last_used', (keep,)).fetchall():
+            try:
+                os.remove(self.entry_path(key))
+            except OSError:
+                pass
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._add(-size)
+            total -= size
+            if total <= self.budget:
+                break
+
+
+def shared_cache(name, budget):
+    # one cache object per directory under CF_MIFT/cache, shared by every thread. None if there is no app data dir
+    if not app_data_dir:
+        return None
+    with _shared_caches_lock:
+        if name not in _shared_caches:
+            _shared_caches[name] = LRUFileCache(pj(app_data_dir, 'CF_MIFT', 'cache', name), budget)
+        return _shared_caches[name]
+
+
+def extraction_cache():
+    return shared_cache('extract', extraction_cache_budget)
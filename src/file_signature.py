@@ -0,0 +1,138 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import os
+import logging
+import filetype
+from concurrent.futures import ThreadPoolExecutor
+
+# Every check is made against one read of this many bytes, the same header filetype would read itself
+header_size = 8192
+
+'''
+Magic values anchored at their offset in the file: (offset, magic, mime, extension). Mime types and
+extensions follow the filetype package, which classifies anything not listed here from the same buffer.
+ISO media files (mp4, mov, heic, 3gp...) are told apart by the 'ftyp' box at offset 4 and its major brand.
+'''
+signatures = ((0, b'\xFF\xD8\xFF', 'image/jpeg', 'jpg'),
+              (0, b'\x89PNG\x0D\x0A\x1A\x0A', 'image/png', 'png'),
+              (0, b'GIF87a', 'image/gif', 'gif'),
+              (0, b'GIF89a', 'image/gif', 'gif'),
+              (0, b'BM', 'image/bmp', 'bmp'),
+              (0, b'\x00\x00\x01\x00', 'image/x-icon', 'ico'),
+              (0, b'\x49\x49\x2A\x00', 'image/tiff', 'tif'),
+              (0, b'\x4D\x4D\x00\x2A', 'image/tiff', 'tif'),
+              (8, b'WEBP', 'image/webp', 'webp'),
+              (8, b'AVI LIST', 'video/x-msvideo', 'avi'),
+              (8, b'4XMV', 'video/x-4xm', '4xm'),
+              (0, b'FLV\x01', 'video/x-flv', 'flv'),
+              (0, b'\x30\x26\xB2\x75\x8E\x66\xCF\x11\xA6\xD9\x00\xAA\x00\x62\xCE\x6C', 'video/x-ms-wmv', 'wmv'),
+              (0, b'\x1A\x45\xDF\xA3', 'video/x-matroska', 'mkv'),
+              (4, b'ftypheic', 'image/heic', 'heic'),
+              (4, b'ftypheix', 'image/heic', 'heic'),
+              (4, b'ftypheim', 'image/heic', 'heic'),
+              (4, b'ftypheis', 'image/heic', 'heic'),
+              (4, b'ftyphevc', 'image/heic', 'heic'),
+              (4, b'ftyphevx', 'image/heic', 'heic'),
+              (4, b'ftypmif1', 'image/heic', 'heic'),
+              (4, b'ftypmsf1', 'image/heic', 'heic'),
+              (4, b'ftypisom', 'video/mp4', 'mp4'),
+              (4, b'ftypiso2', 'video/mp4', 'mp4'),
+              (4, b'ftypmp41', 'video/mp4', 'mp4'),
+              (4, b'ftypmp42', 'video/mp4', 'mp4'),
+              (4, b'ftypMP42', 'video/mp4', 'mp4'),
+              (4, b'ftypavc1', 'video/mp4', 'mp4'),
+              (4, b'ftypMSNV', 'video/mp4', 'mp4'),
+              (4, b'ftypFACE', 'video/mp4', 'mp4'),
+              (4, b'ftypmobi', 'video/mp4', 'mp4'),
+              (4, b'ftypdash', 'video/mp4', 'mp4'),
+              (4, b'ftypM4V ', 'video/x-m4v', 'm4v'),
+              (4, b'ftypqt  ', 'video/quicktime', 'mov'),
+              (4, b'ftypf4v ', 'video/x-f4v', 'f4v'),
+              (4, b'ftypF4V ', 'video/x-f4v', 'f4v'),
+              (4, b'ftyp3gp4', 'video/3gpp', '3gp'),
+              (4, b'ftyp3gp5', 'video/3gpp', '3gp'),
+              (4, b'ftyp3gp6', 'video/3gpp', '3gp'),
+              (4, b'ftypmmp4', 'video/3gpp', '3gp'),
+              (4, b'ftyp3g2a', 'video/3gpp2', '3g2'),
+              # QuickTime files written without an ftyp box start with one of these atoms
+              (4, b'moov', 'video/quicktime', 'mov'),
+              (4, b'mdat', 'video/quicktime', 'mov'),
+              (4, b'wide', 'video/quicktime', 'mov'),
+              (4, b'skip', 'video/quicktime', 'mov'),
+              (4, b'free', 'video/quicktime', 'mov'),
+              (4, b'pnot', 'video/quicktime', 'mov'))
+
+
+def _compile(entries):
+    # [(offset, [(length, {magic: (mime, ext)}), ...]), ...] with the longest magic at each offset tried first,
+    # so each signature is one slice and one dictionary lookup
+    table = dict()
+    for offset, magic, mime, ext in entries:
+        table.setdefault(offset, dict()).setdefault(len(magic), dict())[magic] = (mime, ext)
+    return [(offset, sorted(by_length.items(), reverse=True)) for offset, by_length in sorted(table.items())]
+
+
+_prefix_table = _compile(signatures)
+
+
+def match(head):
+    # (mime, extension) for a header buffer, or (None, None) if it is not recognised
+    head = bytes(head)
+    for offset, by_length in _prefix_table:
+        for length, magics in by_length:
+            kind = magics.get(head[offset:offset + length])
+            if kind:
+                if kind[1] == 'mkv' and b'webm' in head[:64]:
+                    # Matroska and WebM share the EBML header, the DocType that follows it names which
+                    return 'video/webm', 'webm'
+                return kind
+    kind = filetype.guess(head)
+    if kind is None:
+        return None, None
+    return kind.mime, kind.extension
+
+
+def sniff(fp):
+    # reads the header of a file once and classifies it
+    try:
+        with open(fp, 'rb') as f:
+            return match(f.read(header_size))
+    except OSError as err:
+        logging.error('Unable to read {}: {}'.format(fp, err))
+        return None, None
+
+
+def classify(paths, workers=None):
+    # {path: (mime, extension)} for many files. Each is one small read, so threads keep the disk busy
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(paths, pool.map(sniff, paths)))
+
+
+def classify_directory(folder, workers=None):
+    # classifies the files directly within a folder
+    return classify([entry.path for entry in os.scandir(folder) if entry.is_file()], workers)
@@ -37,7 +37,7 @@ import re
 import shutil
 import pandas as pd
 
-from src import extract_archive
+from src import extract_archive, perceptual_hash, media_hashes
 from src.utils import refresh_temp_dir, clean_path, build_dataframe
 
 
@@ -63,6 +63,8 @@ def find_jpeg(cachefile):
 class MakeHuaweiReport(QThread):
     finishedSignal = pyqtSignal(object)
     progressSignal = pyqtSignal(list)
+    extract_members = [clean_path(pj('com.android.gallery3d', 'databases', 'gallery.db')),
+                       clean_path(pj('Android', 'data', 'com.android.gallery3d', 'cache'))]
 
     def __init__(self, *args):
         QThread.__init__(self, args[0])
@@ -84,11 +86,16 @@ class MakeHuaweiReport(QThread):
         rows = list()
         count = 0
         gallery_id_list = gallery_df['local_media_id'].astype(str).values.tolist()
+        hashes = media_hashes.store(self.save_dir)
 
         for gallery_id, dict_values in cache_dict.items():
             row = list()
             with open(pj(self.save_dir, '{}.jpg'.format(gallery_id)), 'wb') as f:
                 f.write(dict_values[0])
+            # carved from memory, so hashed from the same bytes
+            digests = media_hashes.Digests()
+            digests.update(dict_values[0])
+            hashes.record(pj(self.save_dir, '{}.jpg'.format(gallery_id)), digests.hexdigests())
             row.append(abspath(pj(self.save_dir, '{}.jpg'.format(gallery_id))))
             row.append(gallery_id)
             ts = datetime.utcfromtimestamp(int(dict_values[1])).strftime('%d-%m-%Y %H:%M:%S')
@@ -108,19 +115,19 @@ class MakeHuaweiReport(QThread):
 
 
         cache_df = pd.DataFrame(rows, columns=['media', 'id', 'File Name', 'File Path', 'Timestamp', 'Original Status'])
+        cache_df['MD5'], cache_df['SHA-1'] = hashes.columns(cache_df['media'].tolist())
+        hashes.save()
         return cache_df
 
     def run(self):
-        extract_instance = extract_archive.ExtractArchive(self,
-                                                          [clean_path(pj('com.android.gallery3d', 
-                                                                        'databases', 'gallery.db')),
-                                                           clean_path(pj('Android', 'data', 'com.android.gallery3d', 
-                                                                         'cache'))],
-                                                          self.save_dir, self.archive)
+        extract_instance = extract_archive.ExtractArchive(self, self.extract_members, self.save_dir, self.archive)
                                         
         out = extract_instance.extract()
         self.progressSignal.emit([100, out])
         gallery_df = self.build_dataframes()
         cache_dict = find_jpeg(self.cachefile)
         cache_df = self.parse_cache(gallery_df, cache_dict)
+        self.progressSignal.emit([0, 'Grouping similar images...'])
+        cache_df['Similar Group'] = perceptual_hash.similar_groups(
+            cache_df['media'].tolist(), progress=perceptual_hash.progress_reporter(self.progressSignal))
         self.finishedSignal.emit(cache_df)
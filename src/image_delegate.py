@@ -26,24 +26,120 @@ SOFTWARE.
 
 from PyQt5.QtWidgets import QStyledItemDelegate
 from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QBuffer, QByteArray, QIODevice, pyqtSignal
+from collections import OrderedDict
+import logging
+import threading
+import queue
+
+from src import media_preview
+from src import thumbnail_cache
+from src.utils import display_image
+
+# scaled pixmaps kept per delegate, so repainting a cell (scrolling back, resizing) does not decode again
+pixmap_cache_size = 512
+
+
+def rgb_qimage(img):
+    # a QImage holding its own copy of an RGB PIL image
+    return QImage(img.tobytes(), img.width, img.height, img.width * 3, QImage.Format_RGB888).copy()
+
+
+def decode_thumbnail(data, width, height):
+    # the cell sized QImage of data, saved to the thumbnail cache. Runs on the decoder thread, never in paint
+    # the thumbnail embedded in a JPEG or HEIC is enough when it fills the cell, otherwise decode the file
+    preview = media_preview.embedded_preview(data, (width, height), fit=True)
+    image = QImage() if preview is None else rgb_qimage(preview)
+    if image.isNull():
+        image = QImage(data)
+    if image.isNull():
+        # HEIC, video and anything else Qt cannot read are converted here, at the cell size
+        try:
+            image = rgb_qimage(display_image(data, width, height))
+        except Exception as err:
+            logging.error('Unable to display {}: {}'.format(data, err))
+    image = image.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    if not image.isNull():
+        encoded = QByteArray()
+        buf = QBuffer(encoded)
+        buf.open(QIODevice.WriteOnly)
+        image.save(buf, 'JPEG', 90)
+        buf.close()
+        thumbnail_cache.put(data, '{}x{}'.format(width, height), 'JPEG', bytes(encoded))
+    return image
 
 
 class ImageDelegate(QStyledItemDelegate):
     '''
     Manages the style and presentation of media displayed in the QTableView.
+    Paint only draws what is cached; cells that miss are decoded on a background thread and repainted when done,
+    so a video poster frame or a HEIC decode never blocks the GUI.
     '''
+    decodedSignal = pyqtSignal(object)
+
     def __init__(self, parent):
         QStyledItemDelegate.__init__(self, parent)
+        self.pixmaps = OrderedDict()
+        self._pending = set()
+        # last in, first out, so the cells on screen now are decoded before those scrolled past
+        self._requests = queue.LifoQueue()
+        self.decodedSignal.connect(self._decoded)
+        self._decoder = threading.Thread(target=self._decode, daemon=True)
+        self._decoder.start()
+
+    def _decode(self):
+        while True:
+            key = self._requests.get()
+            try:
+                image = decode_thumbnail(*key)
+            except Exception as err:
+                logging.error('Unable to display {}: {}'.format(key[0], err))
+                image = QImage()
+            try:
+                # queued to the GUI thread, where the delegate lives
+                self.decodedSignal.emit((key, image))
+            except RuntimeError:
+                # the view, and this delegate with it, has been closed
+                return
+
+    def _decoded(self, result):
+        key, image = result
+        self._pending.discard(key)
+        self._remember(key, QPixmap.fromImage(image))
+        self.parent().viewport().update()
+
+    def _remember(self, key, pixmap):
+        self.pixmaps[key] = pixmap
+        if len(self.pixmaps) > pixmap_cache_size:
+            self.pixmaps.popitem(last=False)
+
+    def scaled_pixmap(self, data, width, height):
+        # the cached pixmap for this cell, or None once a decode has been queued for it
+        key = (data, width, height)
+        if key in self.pixmaps:
+            self.pixmaps.move_to_end(key)
+            return self.pixmaps[key]
+
+        # cell sized thumbnails persist in the thumbnail cache, so reopening a case does not decode its media again
+        pixmap = QPixmap()
+        cached = thumbnail_cache.get(data, '{}x{}'.format(width, height), 'JPEG')
+        if cached and pixmap.loadFromData(cached, 'JPEG'):
+            self._remember(key, pixmap)
+            return pixmap
+
+        if key not in self._pending:
+            self._pending.add(key)
+            self._requests.put(key)
+        return None
 
     def paint(self, painter, option, index):
         data = index.data()
         if data:
-            image = QImage(data)
             rect = option.rect
-            scaledImage = image.scaled(rect.width(), rect.height(),
-                                       Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            pixmap = QPixmap.fromImage(scaledImage)
+            pixmap = self.scaled_pixmap(data, rect.width(), rect.height())
+            if pixmap is None:
+                painter.drawText(rect, Qt.AlignCenter, 'Loading...')
+                pixmap = QPixmap()
             # Set rect at center of item
             rect.translate((rect.width() - pixmap.width()) // 2,
                            (rect.height() - pixmap.height()) // 2)
@@ -35,7 +35,7 @@ from io import BytesIO
 import pandas as pd
 import shutil
 
-from src import extract_archive, ktx_2_png
+from src import extract_archive, ktx_2_png, media_hashes
 from src.utils import resource_path, decode_bplist, build_dataframe
 
 # timedelta is cocoa UTC epoch - unix UTC epoch
@@ -45,6 +45,8 @@ delta = datetime(2001, 1, 1) - datetime(1970, 1, 1)
 class MakeSnapShotReport(QThread):
     finishedSignal = pyqtSignal(object)
     progressSignal = pyqtSignal(list)
+    # the application state database and the @2x snapshot of each application
+    extract_members = ['applicationState.db', extract_archive.MemberPattern('*@2x.ktx', glob=True)]
 
     def __init__(self, *args):
         QThread.__init__(self, args[0])
@@ -130,10 +132,12 @@ class MakeSnapShotReport(QThread):
             app_guid = basename(ktx_f)[:36]
             try:
                 all_snapshots_dict[app_guid]['media'] = abspath(ktx_png_fn)
+                all_snapshots_dict[app_guid]['ktx'] = ktx_f
             except KeyError:
                 # some ktx will not be attributed to an application/package
                 all_snapshots_dict['Unattributed_{}'.format(count)] = dict()
                 all_snapshots_dict['Unattributed_{}'.format(count)]['media'] = abspath(ktx_png_fn)
+                all_snapshots_dict['Unattributed_{}'.format(count)]['ktx'] = ktx_f
 
         self.progressSignal.emit([100, '{} unsupported files detected'.format(unsupported)])
 
@@ -153,12 +157,14 @@ class MakeSnapShotReport(QThread):
         df.rename(columns={'relativePath': 'File Name', 'groupID': 'Group ID',
                            'GUID': 'GUID Identifier', 'creationDate': 'Created Date',
                            'lastUsedDate': 'Last Used Date'}, inplace=True)
-        df = df[['media', 'GUID Identifier', 'Group ID', 'Created Date', 'Last Used Date', 'File Name']]
         df = df.fillna('')
+        # the png is converted for display; the digests are of the ktx as extracted, recorded before it was removed
+        df['MD5'], df['SHA-1'] = media_hashes.store(self.save_dir).columns(df['ktx'].tolist())
+        df = df[['media', 'GUID Identifier', 'Group ID', 'Created Date', 'Last Used Date', 'File Name', 'MD5', 'SHA-1']]
         return df
 
     def run(self):
-        extract_instance = extract_archive.ExtractArchive(self, ['applicationState.db', '@2x.'],
+        extract_instance = extract_archive.ExtractArchive(self, self.extract_members,
                                                           self.save_dir, self.archive)
                                         
         out = extract_instance.extract()
@@ -0,0 +1,139 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from os.path import join as pj
+from os.path import abspath, relpath, isfile
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+MD5 and SHA-1 of every file extracted into a parser's temp directory.
+Digests are taken from the buffers as ExtractArchive writes each member, so the files are not read again
+to hash them. Files that reach the directory another way (linked from the extraction cache or an input
+folder, carved by a parser) are hashed from disk across a pool of threads. The digests are kept in a
+sidecar in the directory, keyed by path relative to it.
+'''
+sidecar_name = 'media_hashes.json'
+chunk_size = 1024 * 1024
+
+_stores = dict()
+_stores_lock = threading.Lock()
+
+
+class Digests:
+    # MD5 and SHA-1 updated together from the same buffers
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        self.sha1 = hashlib.sha1()
+
+    def update(self, data):
+        self.md5.update(data)
+        self.sha1.update(data)
+
+    def hexdigests(self):
+        return self.md5.hexdigest(), self.sha1.hexdigest()
+
+
+def hash_file(fp):
+    # (md5, sha1) of a file on disk, or None if it cannot be read
+    digests = Digests()
+    try:
+        with open(fp, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digests.update(chunk)
+    except OSError as err:
+        logging.error('Unable to hash {}: {}'.format(fp, err))
+        return None
+    return digests.hexdigests()
+
+
+def hash_files(paths, workers=None):
+    # {path: (md5, sha1)} for files on disk. hashlib releases the GIL on large updates, so threads run side by side
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return {fp: digest for fp, digest in zip(paths, pool.map(hash_file, paths)) if digest}
+
+
+class HashStore:
+    '''
+    The digests recorded for one temp directory. One store is shared by everything extracting into the
+    directory, see store().
+    '''
+    def __init__(self, save_dir):
+        self.save_dir = abspath(save_dir)
+        self.sidecar = pj(self.save_dir, sidecar_name)
+        self._lock = threading.Lock()
+        self._digests = dict()
+        if isfile(self.sidecar):
+            try:
+                with open(self.sidecar, 'r') as f:
+                    self._digests = {key: tuple(value) for key, value in json.load(f).items()}
+            except (OSError, ValueError) as err:
+                logging.error('Unable to read {}: {}'.format(self.sidecar, err))
+
+    def _key(self, fp):
+        return relpath(abspath(fp), self.save_dir).replace('\\', '/')
+
+    def record(self, fp, digests):
+        with self._lock:
+            self._digests[self._key(fp)] = tuple(digests)
+
+    def get(self, fp):
+        with self._lock:
+            return self._digests.get(self._key(fp))
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._digests)
+        try:
+            with open(self.sidecar + '.part', 'w') as f:
+                f.write(data)
+            os.replace(self.sidecar + '.part', self.sidecar)
+        except OSError as err:
+            logging.error('Unable to write {}: {}'.format(self.sidecar, err))
+
+    def columns(self, paths):
+        # MD5 and SHA-1 column values for paths. Any not yet recorded are hashed from disk and recorded
+        paths = list(paths)
+        missing = {fp for fp in paths if fp and self.get(fp) is None and isfile(fp)}
+        if missing:
+            for fp, digests in hash_files(missing).items():
+                self.record(fp, digests)
+            self.save()
+        digests = [self.get(fp) if fp else None for fp in paths]
+        return [d[0] if d else '' for d in digests], [d[1] if d else '' for d in digests]
+
+
+def store(save_dir):
+    with _stores_lock:
+        key = abspath(save_dir)
+        if key not in _stores:
+            _stores[key] = HashStore(key)
+        return _stores[key]
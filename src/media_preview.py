@@ -0,0 +1,171 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import struct
+import logging
+from io import BytesIO
+import PIL.Image
+import pillow_heif
+
+# An embedded thumbnail is only used when it has the same shape as the image, so letterboxed
+# thumbnails (a 4:3 IFD1 thumbnail of a 16:9 photo, for example) fall back to a real decode
+aspect_tolerance = 0.02
+
+_jpeg_sof_markers = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_heic_brands = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1'}
+
+# Exif IFD1 tags giving the offset and length of the JPEG thumbnail
+_tag_thumbnail_offset = 0x0201
+_tag_thumbnail_length = 0x0202
+
+
+def preview_format(fp):
+    # 'jpeg', 'heic' or None, from the first bytes of the file
+    with open(fp, 'rb') as f:
+        head = f.read(12)
+    if head.startswith(b'\xFF\xD8\xFF'):
+        return 'jpeg'
+    if head[4:8] == b'ftyp' and head[8:12] in _heic_brands:
+        return 'heic'
+    return None
+
+
+def _jpeg_header(f):
+    # Walks the marker segments ahead of the first frame. Returns the Exif TIFF block (or None)
+    # and the (width, height) of the image, without reading any of the compressed image data
+    exif = None
+    if f.read(2) != b'\xFF\xD8':
+        return None, None
+    while True:
+        marker = f.read(2)
+        while len(marker) == 2 and marker[0] == 0xFF and marker[1] == 0xFF:
+            marker = marker[1:] + f.read(1)  # fill bytes
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+            return exif, None
+        if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+            continue  # markers without a length
+        length = f.read(2)
+        if len(length) < 2:
+            return exif, None
+        payload = f.read(struct.unpack('>H', length)[0] - 2)
+        if marker[1] == 0xE1 and exif is None and payload.startswith(b'Exif\x00\x00'):
+            exif = payload[6:]
+        elif marker[1] in _jpeg_sof_markers:
+            height, width = struct.unpack_from('>HH', payload, 1)
+            return exif, (width, height)
+
+
+def _exif_thumbnail(tiff):
+    # the JPEG bytes referenced by IFD1 (the thumbnail directory) of an Exif TIFF block
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if order is None:
+        return None
+    try:
+        ifd0 = struct.unpack_from(order + 'L', tiff, 4)[0]
+        count = struct.unpack_from(order + 'H', tiff, ifd0)[0]
+        ifd1 = struct.unpack_from(order + 'L', tiff, ifd0 + 2 + 12 * count)[0]
+        if not ifd1:
+            return None
+        fields = dict()
+        for entry in range(struct.unpack_from(order + 'H', tiff, ifd1)[0]):
+            pos = ifd1 + 2 + 12 * entry
+            tag, field_type = struct.unpack_from(order + 'HH', tiff, pos)
+            # a SHORT value sits in the first two bytes of the value field, a LONG fills it
+            fields[tag] = struct.unpack_from(order + ('H' if field_type == 3 else 'L'), tiff, pos + 8)[0]
+    except struct.error:
+        return None
+    offset, length = fields.get(_tag_thumbnail_offset), fields.get(_tag_thumbnail_length)
+    if not offset or not length or offset + length > len(tiff):
+        return None
+    return tiff[offset:offset + length]
+
+
+def _required_size(image_size, min_size, fit):
+    # The smallest preview that can stand in for the image. Without fit, min_size is the least width
+    # and height needed; with fit, it is a box the image is scaled down into.
+    width, height = image_size
+    if fit:
+        scale = min(min_size[0] / width, min_size[1] / height, 1)
+        return round(width * scale), round(height * scale)
+    return min(min_size[0], width), min(min_size[1], height)
+
+
+def _usable(preview_size, image_size, min_size, fit):
+    if preview_size[0] <= 0 or preview_size[1] <= 0:
+        return False
+    if abs(preview_size[0] / preview_size[1] - image_size[0] / image_size[1]) > \
+            aspect_tolerance * image_size[0] / image_size[1]:
+        return False
+    required = _required_size(image_size, min_size, fit)
+    return preview_size[0] >= required[0] and preview_size[1] >= required[1]
+
+
+def jpeg_thumbnail(fp, min_size, fit=False):
+    # the Exif IFD1 thumbnail of a JPEG (a path or file object) as an RGB image, if it is large enough to stand in
+    if hasattr(fp, 'read'):
+        exif, image_size = _jpeg_header(fp)
+    else:
+        with open(fp, 'rb') as f:
+            exif, image_size = _jpeg_header(f)
+    if not exif or not image_size:
+        return None
+    data = _exif_thumbnail(exif)
+    if not data:
+        return None
+    thumbnail = PIL.Image.open(BytesIO(data))
+    if not _usable(thumbnail.size, image_size, min_size, fit):
+        return None
+    return thumbnail.convert('RGB')
+
+
+def heic_thumbnail(fp, min_size, fit=False):
+    # the smallest thumbnail stored with the primary image that can stand in for it, without decoding the image
+    for image in pillow_heif.open_heif(fp, convert_hdr_to_8bit=True):
+        if not image.info.get('primary'):
+            continue
+        thumbnails = [image.get_thumbnail(pos) for pos in range(len(image.info.get('thumbnails', [])))]
+        thumbnails = [t for t in thumbnails if _usable(t.size, image.size, min_size, fit)]
+        if thumbnails:
+            return min(thumbnails, key=lambda t: t.size[0] * t.size[1]).to_pillow().convert('RGB')
+    return None
+
+
+def embedded_preview(fp, min_size, fit=False, file_ext=None):
+    '''
+    Returns the thumbnail embedded in a JPEG (Exif IFD1) or HEIC (thmb item) as an RGB image, or None
+    if there isn't one big enough. Only the file header and the thumbnail itself are read, the main
+    image is never decoded. min_size is the (width, height) needed, or with fit=True the box the image
+    is to be scaled into. A file object can be given in place of a path, along with its file_ext.
+    '''
+    try:
+        file_ext = (file_ext or preview_format(fp) or '').lower()
+        if file_ext in ('jpg', 'jpeg'):
+            return jpeg_thumbnail(fp, min_size, fit)
+        if file_ext == 'heic':
+            return heic_thumbnail(fp, min_size, fit)
+    except Exception as err:
+        logging.error('Unable to read the embedded thumbnail of {}: {}'.format(fp, err))
+    return None
@@ -0,0 +1,203 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import logging
+from os.path import isfile
+import numpy as np
+import PIL.Image
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+Perceptual hashes of thumbnails, used to group near-duplicates (the same photo cached at different sizes
+by different apps, a thumbnail and its original, edits and re-saves).
+Hashes are 64 bit. Images whose hashes differ in at most similarity_radius bits are treated as similar.
+'''
+similarity_radius = 6
+# images are decoded and hashed in batches of this many, each batch as one set of array operations
+batch_size = 1024
+# rows of a bucket compared against the rest of it at once when finding pairs, bounding memory for large buckets
+pair_block = 256
+
+_phash_size = 32
+_hash_bits = 64
+
+
+def _dct_matrix(n):
+    # orthonormal DCT-II, so an image batch is transformed as D @ X @ D.T
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_dct = _dct_matrix(_phash_size)
+
+
+def _load(fp, method):
+    # a small greyscale array of an image, sized for the hash method, or None if it cannot be decoded
+    if not isfile(fp):
+        return None
+    try:
+        with PIL.Image.open(fp) as img:
+            size = (_phash_size, _phash_size) if method == 'phash' else (9, 8)
+            img.draft('L', (size[0] * 4, size[1] * 4))
+            return np.asarray(img.convert('L').resize(size, PIL.Image.BOX), dtype=np.float32)
+    except Exception as err:
+        logging.error('Unable to hash {}: {}'.format(fp, err))
+        return None
+
+
+def _pack(bits):
+    # (n, 64) booleans to n uint64 hashes
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def phash(pixels):
+    # pHash of a (n, 32, 32) batch: the low 8x8 frequencies of each image's DCT, against their median
+    low = (_dct @ pixels @ _dct.T)[:, :8, :8].reshape(len(pixels), _hash_bits)
+    return _pack(low > np.median(low, axis=1, keepdims=True))
+
+
+def dhash(pixels):
+    # dHash of a (n, 8, 9) batch: whether each pixel is brighter than its left neighbour
+    return _pack((pixels[:, :, 1:] > pixels[:, :, :-1]).reshape(len(pixels), _hash_bits))
+
+
+def popcount(values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def image_hashes(paths, method='phash', workers=None, progress=None):
+    '''
+    Hashes the images at paths. Returns an array of hashes and an array of which paths could be decoded.
+    Decoding runs on a pool of threads, as Pillow releases the GIL while it decodes and resizes.
+    progress(done, total) is called after each batch.
+    '''
+    paths = list(paths)
+    hashes = np.zeros(len(paths), dtype=np.uint64)
+    valid = np.zeros(len(paths), dtype=bool)
+    hasher = phash if method == 'phash' else dhash
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(paths), batch_size):
+            arrays = list(pool.map(lambda fp: _load(fp, method), paths[start:start + batch_size]))
+            ok = np.array([array is not None for array in arrays], dtype=bool)
+            if ok.any():
+                batch = np.stack([array for array in arrays if array is not None])
+                positions = np.flatnonzero(ok) + start
+                hashes[positions] = hasher(batch)
+                valid[positions] = True
+            if progress:
+                progress(min(start + batch_size, len(paths)), len(paths))
+    return hashes, valid
+
+
+class HashIndex:
+    '''
+    Multi-index hashing over 64 bit hashes for Hamming radius queries.
+    Each hash is split into radius + 1 chunks. Two hashes within the radius must agree exactly on at least
+    one chunk, so only the hashes sharing a chunk value with the query are compared.
+    '''
+    def __init__(self, hashes, radius=similarity_radius):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.radius = radius
+        chunks = radius + 1
+        bounds = np.linspace(0, _hash_bits, chunks + 1).astype(int)
+        self._chunks = list()
+        for low, high in zip(bounds[:-1], bounds[1:]):
+            mask = np.uint64((1 << int(high - low)) - 1)
+            values = (self.hashes >> np.uint64(low)) & mask
+            order = np.argsort(values, kind='stable')
+            keys, starts = np.unique(values[order], return_index=True)
+            buckets = np.split(order, starts[1:])
+            self._chunks.append((np.uint64(low), mask, dict(zip(keys.tolist(), buckets))))
+
+    def candidates(self, value):
+        value = np.uint64(value)
+        found = [table.get(int((value >> low) & mask)) for low, mask, table in self._chunks]
+        found = [ids for ids in found if ids is not None]
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def query(self, value):
+        # ids of the hashes within the radius of value
+        ids = self.candidates(value)
+        return ids[popcount(self.hashes[ids] ^ np.uint64(value)) <= self.radius]
+
+    def pairs(self):
+        # yields arrays of (i, j) id pairs within the radius, a block of one bucket at a time
+        for _, _, table in self._chunks:
+            for ids in table.values():
+                values = self.hashes[ids]
+                for start in range(0, len(ids) - 1, pair_block):
+                    block = values[start:start + pair_block]
+                    close = popcount(block[:, None] ^ values[None, start + 1:]) <= self.radius
+                    # only pairs of a row with a later member of the bucket
+                    close &= np.arange(close.shape[1])[None, :] >= np.arange(len(block))[:, None]
+                    rows, cols = np.nonzero(close)
+                    if len(rows):
+                        yield ids[start + rows], ids[start + 1 + cols]
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def progress_reporter(signal):
+    # progress for similar_groups() sent to a parser's progressSignal
+    return lambda done, total: signal.emit([int(done / max(total, 1) * 100), None])
+
+
+def similar_groups(paths, method='phash', radius=similarity_radius, progress=None):
+    '''
+    A group label for each path: images within radius bits of one another, directly or through a chain of
+    similar images, share a label. Images with nothing similar, or that could not be decoded, get ''.
+    '''
+    hashes, valid = image_hashes(paths, method, progress=progress)
+    labels = [''] * len(hashes)
+    if not valid.any():
+        return labels
+    # identical hashes are grouped outright, so the index only holds each distinct hash once
+    unique, inverse = np.unique(hashes[valid], return_inverse=True)
+    parent = list(range(len(unique)))
+    for left, right in HashIndex(unique, radius).pairs():
+        for i, j in zip(left.tolist(), right.tolist()):
+            root_i, root_j = _find(parent, i), _find(parent, j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    roots = [_find(parent, i) for i in inverse.tolist()]
+    sizes = dict()
+    for root in roots:
+        sizes[root] = sizes.get(root, 0) + 1
+    numbers = dict()
+    for position, root in zip(np.flatnonzero(valid).tolist(), roots):
+        if sizes[root] > 1:
+            labels[position] = 'Group {}'.format(numbers.setdefault(root, len(numbers) + 1))
+    return labels
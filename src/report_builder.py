@@ -40,8 +40,52 @@ import numpy as np
 import pandas as pd
 from io import BytesIO
 from subprocess import Popen
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
 from src.utils import *
+from src import evidence_hash
+from src import file_cache
+from src import extract_archive
+from src import file_signature
+from src import video_preview
+
+
+def add_evidence_hashes(save_details, status):
+    # Adds the input archive's MD5 and SHA-256 to the report metadata. Hashing starts when the archive
+    # is opened and runs alongside parsing, so it has usually finished by the time a report is made.
+    evidence = save_details.get('evidence')
+    hasher = evidence_hash.get(evidence) if evidence else None
+    if hasher is None:
+        return
+    while not hasher.done:
+        status('Waiting for the evidence hash to complete ({}%)...'.format(hasher.percent))
+        hasher.wait(5)
+    digests = hasher.wait()
+    if digests:
+        meta = save_details.setdefault('meta', dict())
+        meta['evidence'] = evidence
+        meta['md5'] = digests['md5']
+        meta['sha256'] = digests['sha256']
+
+
+def extract_originals(df, save_details, out_dir, status):
+    # Parsers that stream media from the archive keep only previews, with the archive member of each original in
+    # an 'Original Member' column. A report carries the originals, so they are extracted into it here.
+    # Returns {preview path: path of its original in out_dir}
+    archive = save_details.get('evidence')
+    if 'Original Member' not in df.columns or not archive:
+        return dict()
+    members = {preview: member for preview, member in zip(df['Media'].values.tolist(),
+                                                          df['Original Member'].values.tolist()) if member}
+    if not members:
+        return dict()
+    status('Extracting {} originals from the archive...'.format(len(members)))
+    # written out in full rather than linked from the extraction cache, which an edit to the report copy would change
+    extract_archive.ExtractArchive(None, sorted(set(members.values())), out_dir, archive,
+                                   workers=os.cpu_count(), use_cache=False, hash_outputs=False).extract()
+    originals = {preview: pj(out_dir, basename(member)) for preview, member in members.items()}
+    return {preview: original for preview, original in originals.items() if isfile(original)}
 
 
 class XLSXReportThread(QThread):
@@ -65,10 +109,12 @@ class XLSXReportThread(QThread):
         os.makedirs(self.report_files, exist_ok=True)
 
     def run(self):
+        add_evidence_hashes(self.save_details, self.statusSignal.emit)
         if self.has_media:
             self.progressSignal.emit(50)
             self.statusSignal.emit('Copying files to report location...')
             copy_files(self.df['Media'].values.tolist(), self.temp_dir, self.report_files)
+            extract_originals(self.df, self.save_details, self.report_files, self.statusSignal.emit)
             self.progressSignal.emit(100)
 
         writer = pd.ExcelWriter(self.output_fp, engine='xlsxwriter')
@@ -108,12 +154,14 @@ class HTMLReportThread(QThread):
         self.apply_meta_data(["casename", "Report", self.report_name])
 
     def run(self):
+        add_evidence_hashes(self.save_details, self.statusSignal.emit)
         # Optional metadata
         if 'meta' in self.save_details:
             for metaname, metadata in self.save_details['meta'].items():
                 self.apply_meta_data(
                     ["{}".format(metaname.lower()), "{}".format(metaname.lower().capitalize()), metadata])
 
+        originals = dict()
         if self.has_media:
             self.apply_column_data("Media Source", [{"name": "Miniature", "displayName": "Thumbnail",
                                                      "filter": 'null', "visibleIndex": 0},
@@ -121,6 +169,14 @@ class HTMLReportThread(QThread):
                                                      "filter": 'null', "visibleIndex": 1}])
 
             copy_files(self.df['Media'].values.tolist(), self.temp_dir, self.report_files)
+            originals = extract_originals(self.df, self.save_details, self.report_files, self.statusSignal.emit)
+
+            # video poster frames are read together, under the worker pool's timeouts, before the rows are built
+            kinds = file_signature.classify_directory(self.report_files)
+            videos = [fp for fp, (mime, ext) in kinds.items() if mime and mime.startswith('video')]
+            if videos:
+                self.statusSignal.emit('Reading frames from {} videos...'.format(len(videos)))
+                video_preview.poster_frames(videos)
 
         column_data = list()
         for col_count, col in enumerate(self.df.columns.values.tolist(), start=2):
@@ -139,35 +195,46 @@ class HTMLReportThread(QThread):
                 except ValueError:
                     pass
 
-        count = 0
-        for index, row in self.df.iterrows():
-            row_ = dict()
-            if self.has_media:
-                row_ = {
-                    "id": index,
-                    "Miniature": generate_thumbnail(
-                        pj(self.output_dir, 'files', basename(row['Media'])), self.thumbsize),
-                    "MediaLink": os.path.relpath(pj('files', basename(row['Media']))),
-                    "filename": basename(row['Media']),
-                    "filepath": row['Media']}
-            for k, v in row.items():
-                if k not in row_:
-                    try:
-                        v = v.decode('utf8')
-                    except:
-                        pass
-                    row_.update({k: v})
-
-            row_data.append(row_)
-
-            count += 1
-            self.progressSignal.emit(int(count/len(self.df.index)*100))
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=file_cache.process_context) as pool:
+            count = 0
+            for (index, row), thumbnail in zip(zip(self.df.index, self.df.to_dict('records')),
+                                               self.thumbnails(pool)):
+                row_ = dict()
+                if self.has_media:
+                    row_ = {
+                        "id": index,
+                        "Miniature": thumbnail,
+                        "MediaLink": os.path.relpath(
+                            pj('files', basename(originals.get(row['Media'], row['Media'])))),
+                        "filename": basename(row['Media']),
+                        "filepath": row['Media']}
+                for k, v in row.items():
+                    if k not in row_:
+                        try:
+                            v = v.decode('utf8')
+                        except:
+                            pass
+                        row_.update({k: v})
+
+                row_data.append(row_)
+
+                count += 1
+                self.progressSignal.emit(int(count/len(self.df.index)*100))
 
         self.apply_row_data(row_data)
 
         self.convert_json_to_javascript(json.dumps(self.json_data, cls=NpEncoder))
         self.finishedSignal.emit(self.output_dir)
 
+    def thumbnails(self, pool):
+        # Thumbnails are rendered across a pool of processes and yielded in row order as they complete,
+        # so each row is built while the thumbnails after it are still being rendered
+        if not self.has_media:
+            return repeat(None)
+        media = [pj(self.report_files, basename(fp)) for fp in self.df['Media'].values.tolist()]
+        chunksize = max(1, min(64, len(media) // ((os.cpu_count() or 1) * 8)))
+        return pool.map(generate_thumbnail, media, repeat(self.thumbsize), chunksize=chunksize)
+
     def apply_meta_data(self, meta_list):
         self.json_data['window.caseData']['metaData'][meta_list[0]] = {"title": meta_list[1], "value": meta_list[2]}
 
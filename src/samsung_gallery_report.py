@@ -26,15 +26,24 @@ SOFTWARE.
 
 from PyQt5.QtCore import pyqtSignal, QThread
 from os.path import join as pj
-from os.path import basename, isfile
+from os.path import basename, isfile, isdir
+from io import BytesIO
+import logging
 import pandas as pd
 import sqlite3
 import numpy as np
 import functools
+import itertools
 
 from src import extract_archive
+from src import file_signature
+from src import video_preview
+from src import media_hashes
 from src.utils import *
 
+# Originals streamed from the archive are kept as previews this high, enough for the GUI and the largest report thumbnail
+preview_height = 512
+
 '''
 This dictionary stores each database and a reference to its tables that require building, renaming, 
 reordering and joining. A single joiner should be identified across multiple databases while each table from a
@@ -142,6 +151,10 @@ sec_dict = {'dbs': {'media.db':
 class MakeSamsungReport(QThread):
     finishedSignal = pyqtSignal(object)
     progressSignal = pyqtSignal(list)
+    # the databases. Media files are chosen from their contents once they are parsed
+    extract_members = [clean_path(pj('com.android.providers.media.module', 'databases', 'external.db')),
+                       clean_path(pj('com.samsung.android.providers.media', 'databases', 'media.db')),
+                       clean_path(pj('com.samsung.cmh', 'databases', 'cmh.db'))]
 
     def __init__(self, *args):
         QThread.__init__(self, args[0])
@@ -221,8 +234,42 @@ class MakeSamsungReport(QThread):
         files = df_joined['Display Name'].values.tolist()
         return df_joined, files
 
-    def extract_files(self, files):
+    def stream_originals(self):
+        # set from the File menu. A folder is parsed in place, so there is nothing to save by streaming from it
+        return getattr(self.maingui, 'stream_originals', False) and not isdir(self.archive)
+
+    def stream_previews(self, files):
+        # Reads each original straight from the archive into the thumbnailer and keeps only a preview, along with
+        # the archive member it came from, so the original can be extracted if a report or the user needs it.
+        # Videos, which need a file for their decoder, and anything unrecognised are left to be extracted.
         extract_instance = extract_archive.ExtractArchive(self, files, self.save_dir, self.archive)
+        hashes = media_hashes.store(self.save_dir)
+        previews, members = dict(), dict()
+        for count, (path, fmem) in enumerate(extract_instance.stream(), start=1):
+            name = basename(path)
+            head = fmem.read(file_signature.header_size)
+            mime, ext = file_signature.match(head)
+            if mime and mime.startswith('image'):
+                preview = pj(self.save_dir, '{}.preview.jpg'.format(name))
+                try:
+                    # The original is buffered once and hashed as it is read. It is never written, so its digests
+                    # are recorded under the path it would have had
+                    data, digests = BytesIO(), media_hashes.Digests()
+                    for chunk in itertools.chain([head], iter(lambda: fmem.read(media_hashes.chunk_size), b'')):
+                        data.write(chunk)
+                        digests.update(chunk)
+                    data.seek(0)
+                    hashes.record(pj(self.save_dir, name), digests.hexdigests())
+                    preview_image(data, ext, preview_height).save(preview, format='JPEG', quality=90)
+                    previews[name], members[name] = preview, path
+                except Exception as err:
+                    logging.error('Unable to make a preview of {}: {}'.format(path, err))
+            self.progressSignal.emit([min(100, int(count/max(len(files), 1)*100)), name])
+        hashes.save()
+        return previews, members
+
+    def extract_files(self, files, workers=1):
+        extract_instance = extract_archive.ExtractArchive(self, files, self.save_dir, self.archive, workers=workers)
         out = extract_instance.extract()
         return out
 
@@ -282,24 +329,19 @@ class MakeSamsungReport(QThread):
             df.drop(col_list, axis=1, inplace=True)
         return df
 
-    def generate_thumbnails(self):
-        count = 0
-        img_list = [pj(self.save_dir, img) for img in os.listdir(self.save_dir) if not img.endswith('.db')]
-        img_list_length = len(img_list)
-        for img in img_list:
-            img_raw, ext = media_support(img)
-            img_raw.save(img, format=ext.upper())
-            count += 1
-            self.progressSignal.emit([int(count/img_list_length*100), basename(img)])
-        return
+    def prepare_video_frames(self, media):
+        # Media are left as extracted and converted for display only when shown or exported, at the size needed.
+        # Video poster frames are the exception: they are read here, under the worker pool's timeouts, so that
+        # a corrupt video cannot stall the GUI when its row is painted
+        kinds = file_signature.classify([fp for fp in media if isfile(fp)])
+        videos = [fp for fp, (mime, ext) in kinds.items() if mime and mime.startswith('video')]
+        if videos:
+            self.progressSignal.emit([None, 'Reading frames from {} videos...'.format(len(videos))])
+            video_preview.poster_frames(videos)
 
     def run(self):
         errors = False
-        out = self.extract_files(
-            [clean_path(pj('com.android.providers.media.module', 'databases', 'external.db')),
-            clean_path(pj('com.samsung.android.providers.media', 'databases', 'media.db')),
-            clean_path(pj('com.samsung.cmh', 'databases', 'cmh.db'))]
-            )
+        out = self.extract_files(self.extract_members)
         for db in ['external.db', 'media.db', 'cmh.db']:
             if isfile(pj(self.save_dir, db)):
                 pass
@@ -317,14 +359,24 @@ class MakeSamsungReport(QThread):
         self.progressSignal.emit([50, 'Built dataframes'])
         self.join_tables()
         df, files = self.join_dataframes()
-        self.progressSignal.emit([60, 'Extracting media files...'])
-        out = self.extract_files(files)
-        self.progressSignal.emit([100, 'Media extracted'])
-        media = [pj(self.save_dir, f) for f in files]
+        if self.stream_originals():
+            self.progressSignal.emit([0, 'Reading media from the archive...'])
+            previews, members = self.stream_previews(files)
+            remaining = [f for f in files if f not in previews]
+            if remaining:
+                self.progressSignal.emit([60, 'Extracting {} media files...'.format(len(remaining))])
+                out = self.extract_files(remaining, workers=os.cpu_count())
+            self.progressSignal.emit([100, 'Kept previews of {} originals'.format(len(previews))])
+            media = [previews.get(f, pj(self.save_dir, f)) for f in files]
+            df['Original Member'] = [members.get(f, '') for f in files]
+        else:
+            self.progressSignal.emit([60, 'Extracting media files...'])
+            out = self.extract_files(files, workers=os.cpu_count())
+            self.progressSignal.emit([100, 'Media extracted'])
+            media = [pj(self.save_dir, f) for f in files]
         df['media'] = media
-        self.progressSignal.emit([0, 'Converting media format for GUI Display...'])
-        self.generate_thumbnails()
-        self.progressSignal.emit([100, 'Media converted'])
+        df['MD5'], df['SHA-1'] = media_hashes.store(self.save_dir).columns([pj(self.save_dir, f) for f in files])
+        self.prepare_video_frames(media)
         self.progressSignal.emit([100, 'Cleaning and formatting rows...'])
         df = self.clean_row_values(df)
         self.progressSignal.emit([100, 'Grouping categories...'])
@@ -37,13 +37,16 @@ import sqlite3
 import shutil
 import base64
 
-from src import extract_archive
+from src import extract_archive, perceptual_hash, media_hashes
 from src.utils import clean_path, get_sqlite_rowcount, build_dataframe
 
 
 class MakeSamsungReport(QThread):
     finishedSignal = pyqtSignal(object)
     progressSignal = pyqtSignal(list)
+    extract_members = [clean_path(pj('com.sec.android.app.myfiles', 'databases', 'FileCache.db')),
+                       'external.db',
+                       clean_path(pj('com.sec.android.app.myfiles', 'cache'))]
 
     def __init__(self, *args):
         QThread.__init__(self, args[0])
@@ -104,14 +107,7 @@ class MakeSamsungReport(QThread):
         return filecache_df
 
     def run(self):
-        extract_instance = extract_archive.ExtractArchive(
-                self,
-                [clean_path(pj('com.sec.android.app.myfiles', 'databases', 'FileCache.db')), 
-                'external.db',
-                clean_path(pj('com.sec.android.app.myfiles', 'cache'))],
-                self.save_dir,
-                self.archive
-                )
+        extract_instance = extract_archive.ExtractArchive(self, self.extract_members, self.save_dir, self.archive)
 
         out = extract_instance.extract()
         self.progressSignal.emit([100, out])
@@ -119,4 +115,8 @@ class MakeSamsungReport(QThread):
         filecache_df = self.thumbnail_path(filecache_df)
         filecache_df = self.live_deleted_status(filecache_df)
         filecache_df = self.clean_row_values(filecache_df)
+        filecache_df['MD5'], filecache_df['SHA-1'] = media_hashes.store(self.save_dir).columns(filecache_df['media'].tolist())
+        self.progressSignal.emit([0, 'Grouping similar images...'])
+        filecache_df['Similar Group'] = perceptual_hash.similar_groups(
+            filecache_df['media'].tolist(), progress=perceptual_hash.progress_reporter(self.progressSignal))
         self.finishedSignal.emit(filecache_df)
@@ -38,13 +38,16 @@ import shutil
 import pandas as pd
 import base64
 
-from src import extract_archive
+from src import extract_archive, perceptual_hash, media_hashes
 from src.utils import clean_path, get_sqlite_rowcount, build_dataframe
 
 
 class MakeSonyReport(QThread):
     finishedSignal = pyqtSignal(object)
     progressSignal = pyqtSignal(list)
+    extract_members = [clean_path(pj('com.sonyericsson.album', 'databases', 'picnic')),
+                       'external.db',
+                       clean_path(pj('com.sonyericsson.album', 'cache'))]
 
     def __init__(self, *args):
         QThread.__init__(self, args[0])
@@ -113,14 +116,7 @@ class MakeSonyReport(QThread):
         return cache_df
 
     def run(self):
-        extract_instance = extract_archive.ExtractArchive(
-                self,
-                [clean_path(pj('com.sonyericsson.album', 'databases','picnic')), 
-                'external.db',
-                clean_path(pj('com.sonyericsson.album', 'cache'))],
-                self.save_dir,
-                self.archive
-                )
+        extract_instance = extract_archive.ExtractArchive(self, self.extract_members, self.save_dir, self.archive)
                                         
         out = extract_instance.extract()
         self.progressSignal.emit([100, out])
@@ -128,4 +124,8 @@ class MakeSonyReport(QThread):
         cache_df = self.thumbnail_path(cache_df)
         cache_df = self.live_deleted_status(cache_df)
         cache_df = self.clean_row_values(cache_df)
+        cache_df['MD5'], cache_df['SHA-1'] = media_hashes.store(self.save_dir).columns(cache_df['media'].tolist())
+        self.progressSignal.emit([0, 'Grouping similar images...'])
+        cache_df['Similar Group'] = perceptual_hash.similar_groups(
+            cache_df['media'].tolist(), progress=perceptual_hash.progress_reporter(self.progressSignal))
         self.finishedSignal.emit(cache_df)
@@ -0,0 +1,84 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import logging
+
+from src import file_cache
+
+thumbnail_cache_budget = 1024 * 1024 * 1024
+
+# Thumbnail heights offered by the save dialog. A thumbnail not yet cached is scaled down from a
+# larger one that is, rather than decoded again from the original.
+thumbnail_heights = (64, 128, 256, 512)
+
+
+def thumbnail_cache():
+    return file_cache.shared_cache('thumbnails', thumbnail_cache_budget)
+
+
+def _key(fp, size, codec):
+    # by content, so the copy of a file in a report folder finds the thumbnails made from its original
+    return file_cache.LRUFileCache.key(file_cache.sampled_hash(fp, include_mtime=False), size, codec)
+
+
+def get(fp, size, codec):
+    # the encoded thumbnail of fp for this size and codec, or None
+    cache = thumbnail_cache()
+    if cache is None:
+        return None
+    try:
+        path = cache.get(_key(fp, size, codec))
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError as err:
+        logging.error('Unable to read a cached thumbnail of {}: {}'.format(fp, err))
+        return None
+
+
+def put(fp, size, codec, data):
+    cache = thumbnail_cache()
+    if cache is None or not data:
+        return
+    try:
+        key = _key(fp, size, codec)
+        part = cache.part_path(key)
+        with open(part, 'wb') as f:
+            f.write(data)
+        cache.put(key, part)
+    except OSError as err:
+        logging.error('Unable to cache a thumbnail of {}: {}'.format(fp, err))
+
+
+def larger(fp, height, codec):
+    # the smallest cached thumbnail of fp that is taller than height, or None
+    for taller in thumbnail_heights:
+        if taller > height:
+            data = get(fp, taller, codec)
+            if data:
+                return data
+    return None
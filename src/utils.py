@@ -42,13 +42,18 @@ import base64
 import PIL.Image
 import pillow_heif
 import shutil
-import filetype
 import json
-import cv2
 from io import BytesIO
 import plistlib
 
 from src import ccl_bplist
+from src import media_preview
+from src import file_signature
+from src import video_preview
+from src import thumbnail_cache
+
+# HEIC/HEIF is decoded in-process by libheif, so PIL.Image.open() reads it like any other image
+pillow_heif.register_heif_opener()
 
 start_dir = os.getcwd()
 app_data_dir = os.getenv('APPDATA')
@@ -61,41 +66,6 @@ def copy_files(files, from_dir, to_dir):
             shutil.copy(pj(from_dir, file), to_dir)
 
 
-file_headers = {b'\xFF\xD8\xFF': ['jpeg', 'image'],
-                b'\x89PNG\x0D\x0A\x1A\x0A': ['png', 'image'],
-                b'GIF': ['gif', 'image'],
-                b'BM': ['bmp', 'image'],
-                b'\x00\x00\x01\x00': ['ico', 'image'],
-                b'\x49\x49\x2A\x00': ['tif', 'image'],
-                b'\x4D\x4D\x00\x2A': ['tif', 'image'],
-                b'RIFF': ['avi', 'video'],
-                b'OggS\x00\x02': ['ogg', 'video'],
-                b'ftypf4v\x20': ['f4v', 'video'],
-                b'ftypF4V\x20': ['f4v', 'video'],
-                b'ftypmmp4': ['3gp', 'video'],
-                b'ftyp3g2a': ['3g2', 'video'],
-                b'matroska': ['mkv', 'video'],
-                b'\x01\x42\xF7\x81\x01\x42\xF2\x81)': ['mkv', 'video'],
-                b'moov': ['mov', 'video'],
-                b'skip': ['mov', 'video'],
-                b'mdat': ['mov', 'video'],
-                b'\x00\x00\x00\x14pnot': ['mov', 'video'],
-                b'\x00\x00\x00\x08wide)': ['mov', 'video'],
-                b'ftypmp41': ['mp4', 'video'],
-                b'ftypavc1': ['mp4', 'video'],
-                b'ftypMSNV': ['mp4', 'video'],
-                b'ftypFACE': ['mp4', 'video'],
-                b'ftypmobi': ['mp4', 'video'],
-                b'ftypmp42': ['mp4', 'video'],
-                b'ftypMP42': ['mp4', 'video'],
-                b'ftypdash': ['mp4', 'video'],
-                b'\x30\x26\xB2\x75\x8E\x66\xCF\x11\xA6\xD9\x00\xAA\x00\x62\xCE\x6C': ['wmv', 'video'],
-                b'4XMVLIST': ['4xm', 'video'],
-                b'FLV\x01': ['flv', 'video'],
-                b'\x1A\x45\xDF\xA3\x01\x00\x00\x00': ['webm', 'video'],
-                b'ftypheic': ['heic', 'image']}
-
-
 class NpEncoder(json.JSONEncoder):
     # converts numpy objects so they can be serialised
     def default(self, obj):
@@ -109,6 +79,31 @@ class NpEncoder(json.JSONEncoder):
 
 
 def heic_2_jpg(img_fp):
+    # Convert heic to a jpg alongside it and return the absolute path to the jpg
+    out_fp = abspath(pj(dirname(img_fp), basename(img_fp).split('.')[0] + '.jpg'))
+    img = open_heic(img_fp)
+    if img is None:
+        return 'Error'
+    img.save(out_fp, format='JPEG', quality=95)
+    return out_fp
+
+
+def open_heic(img_fp):
+    # decodes a heic to an RGB image, or returns None if it cannot be read
+    try:
+        with PIL.Image.open(img_fp, 'r') as img:
+            return img.convert('RGB')
+    except Exception as err:
+        logging.error('Unable to decode {}: {}'.format(img_fp, err))
+    if sys.platform == 'win32':
+        # the Windows codec may read HEIC variants libheif does not
+        out = _heic_2_jpg_powershell(img_fp)
+        if out not in ('Error', 'Keep'):
+            return PIL.Image.open(out, 'r')
+    return None
+
+
+def _heic_2_jpg_powershell(img_fp):
     # Convert heic to jpg. Check it is supported and has been converted
     p = Popen(['powershell', resource_path('ConvertTo-Jpeg.ps1'), img_fp],
               shell=False, stderr=PIPE, stdout=PIPE)
@@ -123,52 +118,50 @@ def heic_2_jpg(img_fp):
 
 
 def get_image_type(img_fp):
-    file_typ, file_ext = None, None
-    kind = filetype.guess(img_fp)
-    if kind is None:
-        with open(img_fp, 'rb') as bf:
-            line = bf.read(50)
-            for head, ext in file_headers.items():
-                if head in line:
-                    file_typ, file_ext = ext
-    else:
-        file_typ, file_ext = kind.mime, kind.extension
-    return file_typ, file_ext
+    # (mime type, extension) from a single read of the file header, or (None, None) if unrecognised
+    return file_signature.sniff(img_fp)
 
 
 def get_video_frame(fp):
-    # gets the first frame of a video
+    # gets the first frame of a video, decoded once in the video worker pool and cached from then on
     try:
-        cap = cv2.VideoCapture(fp)
-        _, cv2_img = cap.read()
-        cv2_img = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2RGB)
-        img = PIL.Image.fromarray(cv2_img)
-        file_ext = 'JPEG'
-        return img, file_ext
+        img = video_preview.poster_frame(fp)
+        if img is None:
+            return False, False
+        return img, 'JPEG'
     except Exception as e:
-        print(e)
+        logging.error('Unable to get a frame from {}: {}'.format(fp, e))
         return False, False
 
 
-def media_support(fp):
+def media_support(fp, min_size=None):
     # analyses the media file for file signature etc so that it can be displayed in the GUI
     # if a file is not supported, a placeholder (blank image) is returned.
+    # When only a smaller image is needed, min_size (width, height) lets the decoder skip work: the
+    # thumbnail embedded in a JPEG or HEIC is used if it covers min_size, otherwise a JPEG is decoded at
+    # 1/2, 1/4 or 1/8 scale. Other formats are decoded in full.
     file_type, file_ext = get_image_type(fp)
 
-    if file_type and file_ext:
+    preview = None
+    if min_size and file_ext in ('jpg', 'jpeg', 'heic'):
+        preview = media_preview.embedded_preview(fp, min_size, file_ext=file_ext)
+
+    if preview is not None:
+        img, file_ext = preview, 'JPEG'
+
+    elif file_type and file_ext:
         if file_ext == 'heic':
-            out = heic_2_jpg(fp)
-            if out == 'Keep':
-                img = PIL.Image.open(out, 'r')
-            elif out == 'Error':
+            img = open_heic(fp)
+            if img is None:
                 img = PIL.Image.open(resource_path('blank_jpeg.png'), 'r')
                 file_ext = 'PNG'
             else:
-                img = PIL.Image.open(out, 'r')
                 file_ext = 'JPEG'
 
         elif file_type.startswith('image'):
             img = PIL.Image.open(fp, 'r')
+            if min_size and img.format == 'JPEG':
+                img.draft(img.mode, min_size)
 
         elif file_type.startswith('video'):
             img, file_ext = get_video_frame(fp)
@@ -191,19 +184,62 @@ def media_support(fp):
     return img, file_ext
 
 
+def preview_image(fmem, file_ext, height):
+    # A display copy, at most height pixels high, of an image read from a file object (an archive member
+    # streamed by a parser, for instance). Embedded thumbnails are used when they are tall enough.
+    # A member the caller has already buffered is used as it is rather than copied again
+    data = fmem if isinstance(fmem, BytesIO) else BytesIO(fmem.read())
+    img = media_preview.embedded_preview(data, (1, height), file_ext=file_ext)
+    if img is None:
+        data.seek(0)
+        img = PIL.Image.open(data)
+        if img.format == 'JPEG':
+            img.draft(img.mode, (1, height))
+        img = img.convert('RGB')
+    if img.height > height:
+        img = img.resize((max(1, round(img.width * height / img.height)), height),
+                         PIL.Image.LANCZOS, reducing_gap=2.0)
+    return img
+
+
+def display_image(fp, width, height):
+    # An RGB image of any supported media (HEIC, video frames...) scaled to fit within width x height.
+    # Media are converted like this when they are shown, rather than rewritten for display after extraction
+    img, file_ext = media_support(fp, min_size=(width, height))
+    img = img.convert('RGB')
+    img.thumbnail((width, height), PIL.Image.LANCZOS, reducing_gap=2.0)
+    return img
+
+
 def generate_thumbnail(fp, thmbsize=128):
-    # converts images to a thumbnail format for reports
-    img, file_ext = media_support(fp)
+    # converts images to a thumbnail format for reports, reusing the one in the thumbnail cache if there is one.
+    # Report thumbnails keep the format of their source, hence the 'source' codec
+    thmbsize = int(thmbsize)
+    data = thumbnail_cache.get(fp, thmbsize, 'source')
+    if data is None:
+        data = render_thumbnail(fp, thmbsize)
+        thumbnail_cache.put(fp, thmbsize, 'source', data)
+    return base64.b64encode(data).decode('utf8')
+
+
+def render_thumbnail(fp, thmbsize):
+    # Thumbnails have a fixed height, so the image only needs decoding at a scale that is at least thmbsize
+    # high. A larger thumbnail already cached for another report is scaled down instead of the original
+    larger = thumbnail_cache.larger(fp, thmbsize, 'source')
+    if larger:
+        img = PIL.Image.open(BytesIO(larger))
+        file_ext = img.format
+    else:
+        img, file_ext = media_support(fp, min_size=(1, thmbsize))
 
-    hpercent = (int(thmbsize) / float(img.size[1]))
-    wsize = int((float(img.size[0]) * float(hpercent)))
-    img = img.resize((wsize, int(thmbsize)), PIL.Image.ANTIALIAS)
+    hpercent = (thmbsize / float(img.size[1]))
+    wsize = max(1, int((float(img.size[0]) * float(hpercent))))
+    # reducing_gap shrinks by a whole factor with reduce() first, so LANCZOS only filters the last step
+    img = img.resize((wsize, thmbsize), PIL.Image.LANCZOS, reducing_gap=2.0)
 
     buf = BytesIO()
     img.save(buf, format=file_ext.upper())
-    b64_thumb = base64.b64encode(buf.getvalue()).decode('utf8')
-
-    return b64_thumb
+    return buf.getvalue()
 
 
 def row_combiner(row, cols):
@@ -28,58 +28,212 @@ from PyQt5.QtCore import pyqtSignal, QThread
 import os
 import logging
 import platform
-import zipfile
 import tarfile
+import zipfile
+from os.path import getsize
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src import archive_index, file_cache
+from src.extract_archive import size_balanced_batches, default_buffer_size
+
+# integrity check modes
+integrity_off = None
+integrity_parser = 'parser'  # only the members the chosen parser extracts
+integrity_all = 'all'
+
+# tar headers are checked in runs of this many members per worker task
+tar_batch_members = 4096
+
+_worker_fp = None
+
+
+def _init_check_worker(archive, archive_type):
+    # each worker process reads through its own handle on the archive
+    global _worker_fp
+    if archive_type == 'zip':
+        _worker_fp = open(archive, 'rb')
+    else:
+        _worker_fp, _ = archive_index.tar_stream(archive)
+
+
+def _check_zip_batch(batch, buffer_size):
+    # Streams each member and compares the CRC-32 of its data with the central directory.
+    # Returns (members checked, [(path, problem)])
+    bad = list()
+    buffer = memoryview(bytearray(buffer_size))
+    for (header_offset, compress_type, compress_size), (path, crc, file_size, flag_bits) in batch:
+        try:
+            if flag_bits & 0x1:
+                bad.append((path, 'encrypted, not checked'))
+                continue
+            info = zipfile.ZipInfo(path)
+            info.header_offset, info.compress_type, info.compress_size = header_offset, compress_type, compress_size
+            info.CRC, info.file_size, info.flag_bits = crc, file_size, flag_bits
+            # both ZipMemberReader and zipfile's reader raise on a CRC-32 or size mismatch once the data is read
+            with archive_index.open_zip_member(_worker_fp, info) as fmem:
+                while fmem.readinto(buffer):
+                    pass
+        except Exception as err:
+            bad.append((path, str(err)))
+    return len(batch), bad
+
+
+def _check_tar_batch(batch, archive_end):
+    # Recomputes the checksum of each member's header block, and of the extended (pax or GNU long name)
+    # header before it. Returns (members checked, [(path, problem)])
+    bad = list()
+    for path, offset, offset_data, size in batch:
+        try:
+            for header_offset in sorted({offset, offset_data - tarfile.BLOCKSIZE}):
+                _worker_fp.seek(header_offset)
+                block = _worker_fp.read(tarfile.BLOCKSIZE)
+                if len(block) < tarfile.BLOCKSIZE:
+                    raise EOFError('header truncated at offset {}'.format(header_offset))
+                if tarfile.nti(block[148:156]) not in tarfile.calc_chksums(block):
+                    raise ValueError('bad header checksum at offset {}'.format(header_offset))
+            if archive_end is not None and offset_data + size > archive_end:
+                raise EOFError('data truncated, archive ends before offset {}'.format(offset_data + size))
+        except Exception as err:
+            bad.append((path, str(err)))
+    return len(batch), bad
+
+
+def _check_tar_end(end_offset):
+    # tarfile stops listing at the first unreadable header as if the archive had ended there,
+    # so the block after the last member read must be the end-of-archive marker or the end of the file
+    _worker_fp.seek(end_offset)
+    block = _worker_fp.read(tarfile.BLOCKSIZE)
+    if block and block.count(0) != len(block):
+        return 0, [('offset {}'.format(end_offset), 'unreadable header, the members after it are not listed')]
+    return 0, []
 
 
 class VerifyArchiveThread(QThread):
     finishedSignal = pyqtSignal(list)
     progressSignal = pyqtSignal(str)
 
-    def __init__(self, parent, archive, paths, oem):
+    def __init__(self, parent, archive, paths, oem, integrity=integrity_off, members=None, workers=None):
         QThread.__init__(self, parent)
         self.archive = archive
         self.paths = paths
         self.oem = oem
         self.errors = []
+        # integrity_parser checks only the members matching these needles
+        self.integrity = integrity
+        self.members = members or paths
+        self.workers = workers or os.cpu_count()
 
     def close(self):
         self.terminate()
 
+    def _found_progress(self, found, total, members_read):
+        self.progressSignal.emit('Located {}/{} required paths ({} archive members read)'.format(
+            found, total, members_read))
+
+    def check_integrity(self):
+        # returns [(member path, problem)] for every member that failed
+        index = archive_index.get_index(self.archive)
+        if self.integrity == integrity_parser:
+            selected = sorted({idx for needle in self.members for idx in index.find(needle)})
+        else:
+            selected = [idx for idx in range(len(index)) if not index.is_dir[idx]]
+
+        workers = self.workers
+        if index.archive_type == 'zip':
+            jobs = list()
+            for idx in selected:
+                info = index.infos[idx]
+                jobs.append(((info.header_offset, info.compress_type, info.compress_size),
+                             (index.paths[idx], info.CRC, info.file_size, info.flag_bits)))
+            tasks = [(_check_zip_batch, batch, default_buffer_size) for batch in size_balanced_batches(jobs)]
+        else:
+            stream, seekable = archive_index.tar_stream(self.archive)
+            stream.close()
+            # truncation of an uncompressed tar is found from the file size, a compressed one fails to inflate
+            archive_end = getsize(self.archive) if seekable and not archive_index.is_gzip(self.archive) else None
+            if not seekable:
+                workers = 1  # every worker would decompress the archive from the start
+            jobs = [(index.paths[idx], index.infos[idx].offset, index.infos[idx].offset_data,
+                     index.infos[idx].size) for idx in selected]
+            tasks = [(_check_tar_batch, jobs[pos:pos + tar_batch_members], archive_end)
+                     for pos in range(0, len(jobs), tar_batch_members)]
+            if index.infos:
+                last = index.infos[-1]
+                blocks, remainder = divmod(last.size, tarfile.BLOCKSIZE)
+                tasks.append((_check_tar_end, last.offset_data + (blocks + bool(remainder)) * tarfile.BLOCKSIZE))
+
+        self.progressSignal.emit('Checking the integrity of {} archive members across {} processes...'.format(
+            len(selected), workers))
+        bad, checked = list(), 0
+        with ProcessPoolExecutor(max_workers=workers, mp_context=file_cache.process_context,
+                                 initializer=_init_check_worker, initargs=(self.archive, index.archive_type)) as pool:
+            futures = [pool.submit(*task) for task in tasks]
+            for future in as_completed(futures):
+                count, batch_bad = future.result()
+                checked += count
+                for path, problem in batch_bad:
+                    logging.error('Integrity: {} - {}'.format(path, problem))
+                    self.progressSignal.emit('[!] Integrity: {} - {}'.format(path, problem))
+                bad.extend(batch_bad)
+                self.progressSignal.emit('Integrity: checked {}/{} members, {} failed'.format(
+                    checked, len(selected), len(bad)))
+        return bad
+
     def run(self):
-        archive_members = None
+        missing, member_count = None, 0
 
-        if zipfile.is_zipfile(self.archive):
+        archive_type = archive_index.archive_type(self.archive)
+        if archive_type == 'zip':
             self.progressSignal.emit('Zip archive confirmed, verifying contents...')
             try:
-                with zipfile.ZipFile(self.archive, 'r') as zip_obj:
-                    archive_members = zip_obj.namelist()
+                missing, member_count = archive_index.find_required(self.archive, self.paths)
             except Exception as e:
                 logging.error(e)
                 self.errors.append('Unable to read zip archive, refer to file>log.')
 
-        elif tarfile.is_tarfile(self.archive):
+        elif archive_type == 'tar':
+            # tar headers are read in order and reading stops once every required path is found
             self.progressSignal.emit('Tar archive confirmed, verifying contents...')
             try:
-                with tarfile.open(self.archive, 'r') as tar_obj:
-                    archive_members = tar_obj.getnames()
+                missing, member_count = archive_index.find_required(self.archive, self.paths,
+                                                                    progress=self._found_progress)
             except Exception as e:
                 logging.error(e)
                 self.errors.append('Unable to read tar archive, refer to file>log.')
 
+        elif archive_type == 'dir':
+            self.progressSignal.emit('Folder confirmed, verifying contents...')
+            try:
+                missing, member_count = archive_index.find_required(self.archive, self.paths)
+            except Exception as e:
+                logging.error(e)
+                self.errors.append('Unable to read folder, refer to file>log.')
+
         else:
             self.errors.append(
-                '[!] ERROR\n\nUnrecognised file format\nInput must be a zip or tar archive')
+                '[!] ERROR\n\nUnrecognised file format\nInput must be a zip or tar archive, or a folder')
 
-        if archive_members:
-            for path in self.paths:
-                if any(path in archive_member for archive_member in archive_members):
-                    pass
-                else:
-                    self.errors.append('[!] Missing: {}'.format(path))
+        if member_count:
+            for path in missing:
+                self.errors.append('[!] Missing: {}'.format(path))
         else:
             self.errors.append('No files were processed.')
 
+        if self.integrity and not self.errors:
+            if archive_type == 'dir':
+                self.progressSignal.emit('Integrity check skipped, the input is a folder.')
+            else:
+                try:
+                    bad = self.check_integrity()
+                    if bad:
+                        self.progressSignal.emit('[!] Integrity check complete: {} members failed, '
+                                                 'refer to file>log.'.format(len(bad)))
+                    else:
+                        self.progressSignal.emit('Integrity check complete: no errors found.')
+                except Exception as e:
+                    logging.error(e)
+                    self.progressSignal.emit('[!] Unable to complete the integrity check, refer to file>log.')
+
         if self.errors:
             self.errors.append(
                 '\nThe file structure of the archive is important. If you are outputting files '
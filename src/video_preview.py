@@ -0,0 +1,239 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import os
+import time
+import logging
+import tempfile
+import threading
+import multiprocessing.connection
+from os.path import join as pj
+from os.path import getsize, isfile
+import cv2
+import PIL.Image
+
+from src import file_cache
+
+# Poster frames are stored no larger than this on their longest edge, enough for the GUI and any report thumbnail
+poster_size = 1024
+# a video whose first frame takes longer than this to decode is given up on, and its worker replaced
+frame_timeout = 30
+poster_cache_budget = 512 * 1024 * 1024
+
+# Pools not running a batch. Each caller takes its own, so a GUI paint never waits behind a parser's batch
+_idle_pools = list()
+_pool_lock = threading.Lock()
+_fallback_dir = None
+_fallback_posters = dict()
+
+
+def _write_poster(fp, out_fp, max_size):
+    # Decodes the first frame of a video, which is always a keyframe, so nothing before it is decoded.
+    # The frame is shrunk before it is encoded, so only a small JPEG leaves the worker.
+    cap = cv2.VideoCapture(fp)
+    try:
+        ok, frame = cap.read()
+        if not ok or frame is None:
+            return False
+        height, width = frame.shape[:2]
+        scale = min(1.0, max_size / max(width, height))
+        if scale < 1.0:
+            frame = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if not ok:
+            return False
+        with open(out_fp, 'wb') as f:
+            f.write(jpeg.tobytes())
+        return True
+    finally:
+        cap.release()
+
+
+def _worker(conn):
+    # runs in a pool process, handling one (video, output path, size) task at a time until sent None
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        try:
+            conn.send(_write_poster(*task))
+        except Exception as err:
+            logging.error('Unable to read a frame from {}: {}'.format(task[0], err))
+            conn.send(False)
+
+
+class PosterFramePool:
+    '''
+    A fixed set of processes that decode poster frames from videos.
+    Each video is given frame_timeout seconds. A worker that runs over, or crashes in the decoder,
+    is killed and replaced, so one corrupt file costs its timeout rather than the whole run.
+    '''
+    def __init__(self, workers=None, timeout=frame_timeout):
+        self.size = workers or max(1, min(4, os.cpu_count() or 1))
+        self.timeout = timeout
+        self._workers = list()
+
+    @staticmethod
+    def _start_worker():
+        parent_conn, child_conn = file_cache.process_context.Pipe()
+        process = file_cache.process_context.Process(target=_worker, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _replace(self, worker):
+        process, conn = worker
+        process.kill()
+        process.join()
+        conn.close()
+        new = self._start_worker()
+        self._workers[self._workers.index(worker)] = new
+        return new
+
+    def close(self):
+        for process, conn in self._workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+            conn.close()
+        self._workers = list()
+
+    def run(self, tasks):
+        # Tasks are (video, output path) pairs. Yields (task, ok) for each, in the order they finish. ok is
+        # True once a frame is written, False if the decoder could not read one, or None if the worker timed
+        # out or crashed, which may not happen on a later attempt (e.g. a slow network share)
+        tasks = list(reversed(tasks))
+        while len(self._workers) < min(self.size, len(tasks)):
+            self._workers.append(self._start_worker())
+        idle = list(self._workers)
+        busy = dict()
+        while tasks or busy:
+            while tasks and idle:
+                worker, task = idle.pop(), tasks.pop()
+                worker[1].send((task[0], task[1], poster_size))
+                busy[worker[1]] = (worker, task, time.monotonic() + self.timeout)
+
+            wait = max(0, min(deadline for _, _, deadline in busy.values()) - time.monotonic())
+            for conn in multiprocessing.connection.wait(list(busy), timeout=wait):
+                worker, task, _ = busy.pop(conn)
+                try:
+                    ok = conn.recv()
+                except (EOFError, OSError):
+                    logging.error('The video decoder stopped while reading {}'.format(task[0]))
+                    worker, ok = self._replace(worker), None
+                idle.append(worker)
+                yield task, ok
+
+            now = time.monotonic()
+            for conn, (worker, task, deadline) in list(busy.items()):
+                if deadline <= now:
+                    del busy[conn]
+                    logging.error('Gave up on a frame from {} after {} seconds'.format(task[0], self.timeout))
+                    idle.append(self._replace(worker))
+                    yield task, None
+
+
+def poster_cache():
+    return file_cache.shared_cache('posters', poster_cache_budget)
+
+
+def poster_frames(paths):
+    '''
+    Returns {video: path of its poster frame JPEG, or None if no frame could be read}.
+    Poster frames are kept in the posters cache by content, so the GUI and every report share one decode
+    per video. Videos not yet cached are decoded together across a pool. A video the decoder reports as
+    unreadable is cached as an empty entry, so it is not tried again. One that timed out or crashed the
+    decoder is not cached, and is tried again next time.
+    '''
+    cache = poster_cache()
+    posters, pending = dict(), dict()
+    for fp in paths:
+        if fp in posters or fp in pending:
+            continue
+        try:
+            key = file_cache.LRUFileCache.key(file_cache.sampled_hash(fp, include_mtime=False), poster_size)
+        except OSError as err:
+            logging.error('Unable to read {}: {}'.format(fp, err))
+            posters[fp] = None
+            continue
+        if cache is None:
+            cached = _fallback_posters.get(key)
+        else:
+            cached = cache.get(key)
+        if cached is not None:
+            posters[fp] = cached if getsize(cached) else None
+        else:
+            pending[fp] = key
+
+    if not pending:
+        return posters
+    with _pool_lock:
+        pool = _idle_pools.pop() if _idle_pools else PosterFramePool()
+    try:
+        tasks = [(fp, _part_path(cache, key)) for fp, key in pending.items()]
+        for (fp, part), ok in pool.run(tasks):
+            if ok is None:
+                if isfile(part):
+                    os.remove(part)
+                posters[fp] = None
+                continue
+            if not ok:
+                # an empty entry records that the video has no readable frame
+                open(part, 'wb').close()
+            if cache is None:
+                _fallback_posters[pending[fp]] = part
+                cached = part
+            else:
+                cached = cache.put(pending[fp], part)
+            posters[fp] = cached if ok else None
+    finally:
+        with _pool_lock:
+            _idle_pools.append(pool)
+    return posters
+
+
+def _part_path(cache, key):
+    global _fallback_dir
+    if cache is not None:
+        return cache.part_path(key)
+    # without an app data dir, posters only last as long as this run
+    if _fallback_dir is None:
+        _fallback_dir = tempfile.mkdtemp(prefix='mift_posters_')
+    return pj(_fallback_dir, key + '.jpg')
+
+
+def poster_frame(fp):
+    # the poster frame of one video as an RGB image, or None
+    poster = poster_frames([fp]).get(fp)
+    if poster is None or not isfile(poster):
+        return None
+    with PIL.Image.open(poster) as img:
+        return img.convert('RGB')
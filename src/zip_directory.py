@@ -0,0 +1,201 @@
+"""
+MIT License
+
+mift - Copyright (c) 2021-2022 Control-F
+Author: Mike Bangham (Control-F)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, 'mift', and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import struct
+import zipfile
+from array import array
+
+# record layouts, as in zipfile
+_eocd = struct.Struct('<4s4H2LH')
+_eocd64_locator = struct.Struct('<4sLQL')
+_eocd64 = struct.Struct('<4sQ2H2L4Q')
+_central_header = struct.Struct('<4s6H3L5H2L')
+_zip64_extra = 0x0001
+_max_comment = 0xFFFF
+
+# the central directory is decoded in chunks of this size rather than read whole
+read_size = 4 * 1024 * 1024
+
+
+class ZipDirectory:
+    '''
+    The central directory of a zip archive held as columns.
+    zipfile.ZipFile builds a ZipInfo object for every member as it opens, which for a full file system
+    of several million members costs hundreds of MB before a single path can be checked. Here each field
+    is kept in an array, and member names are kept as one block of encoded bytes, so a member costs a few
+    tens of bytes. A ZipInfo is only built for the members that are actually extracted.
+    '''
+    def __init__(self, archive):
+        self.archive = archive
+        self.flag_bits = array('H')
+        self.compress_type = array('H')
+        self.crc = array('L')
+        self.compress_size = array('Q')
+        self.file_size = array('Q')
+        self.header_offset = array('Q')
+        self._name_blob = bytearray()
+        self._name_ends = array('Q')
+        with open(archive, 'rb') as fp:
+            self._read(fp)
+
+    def __len__(self):
+        return len(self._name_ends)
+
+    def __getitem__(self, idx):
+        # a ZipInfo carrying what is needed to open the member, for ZipMemberReader or zipfile
+        info = zipfile.ZipInfo(self.name(idx))
+        info.flag_bits = self.flag_bits[idx]
+        info.compress_type = self.compress_type[idx]
+        info.CRC = self.crc[idx]
+        info.compress_size = self.compress_size[idx]
+        info.file_size = self.file_size[idx]
+        info.header_offset = self.header_offset[idx]
+        return info
+
+    def name(self, idx):
+        start = self._name_ends[idx - 1] if idx else 0
+        raw = bytes(self._name_blob[start:self._name_ends[idx]])
+        # names are UTF-8 when flagged, otherwise cp437, as zipfile decodes them
+        return raw.decode('utf-8' if self.flag_bits[idx] & 0x800 else 'cp437')
+
+    def entries(self):
+        # (name, is directory) for each member, in central directory order
+        for idx in range(len(self)):
+            name = self.name(idx)
+            yield name, name.endswith('/')
+
+    def _read(self, fp):
+        count, size, offset = self._end_record(fp)
+        fp.seek(offset)
+        buf, pos, remaining = b'', 0, size
+        for _ in range(count):
+            if len(buf) - pos < _central_header.size:
+                buf, pos, remaining = self._refill(fp, buf, pos, remaining, _central_header.size)
+            (sig, _, _, flags, method, _, _, crc, csize, usize,
+             name_len, extra_len, comment_len, _, _, _, local_offset) = _central_header.unpack_from(buf, pos)
+            if sig != b'PK\x01\x02':
+                raise zipfile.BadZipFile('Bad magic number for central directory')
+            record_len = _central_header.size + name_len + extra_len + comment_len
+            if len(buf) - pos < record_len:
+                buf, pos, remaining = self._refill(fp, buf, pos, remaining, record_len)
+            name_start = pos + _central_header.size
+            if 0xFFFFFFFF in (csize, usize, local_offset):
+                usize, csize, local_offset = self._zip64_fields(
+                    buf, name_start + name_len, extra_len, usize, csize, local_offset)
+
+            self._name_blob += buf[name_start:name_start + name_len]
+            self._name_ends.append(len(self._name_blob))
+            self.flag_bits.append(flags)
+            self.compress_type.append(method)
+            self.crc.append(crc)
+            self.compress_size.append(csize)
+            self.file_size.append(usize)
+            self.header_offset.append(local_offset + self._concat)
+            pos += record_len
+
+    @staticmethod
+    def _refill(fp, buf, pos, remaining, needed):
+        buf = buf[pos:]
+        while len(buf) < needed:
+            chunk = fp.read(min(remaining, max(read_size, needed - len(buf))))
+            if not chunk:
+                raise zipfile.BadZipFile('Truncated central directory')
+            remaining -= len(chunk)
+            buf += chunk
+        return buf, 0, remaining
+
+    @staticmethod
+    def _zip64_fields(buf, pos, extra_len, usize, csize, local_offset):
+        # values too large for the central header are held, in this order, in the zip64 extra field
+        end = pos + extra_len
+        while pos + 4 <= end:
+            tag, length = struct.unpack_from('<HH', buf, pos)
+            if tag == _zip64_extra:
+                values = iter(struct.unpack_from('<{}Q'.format(length // 8), buf, pos + 4))
+                try:
+                    if usize == 0xFFFFFFFF:
+                        usize = next(values)
+                    if csize == 0xFFFFFFFF:
+                        csize = next(values)
+                    if local_offset == 0xFFFFFFFF:
+                        local_offset = next(values)
+                except StopIteration:
+                    raise zipfile.BadZipFile('Corrupt zip64 extra field')
+                break
+            pos += 4 + length
+        return usize, csize, local_offset
+
+    @staticmethod
+    def _find_end_record(tail, tail_offset):
+        # The archive comment follows the end record and may itself contain its signature, so each candidate
+        # is checked: its comment must fit in the file and its central directory must end before it. One
+        # whose comment runs exactly to the end of the file is preferred, otherwise the last plausible one is
+        # used (e.g. bytes appended after the archive).
+        fallback = -1
+        pos = tail.rfind(b'PK\x05\x06')
+        while pos >= 0:
+            if pos + _eocd.size <= len(tail):
+                _, _, _, _, _, size, offset, comment_len = _eocd.unpack_from(tail, pos)
+                # zip64 archives leave these fields at their maximum and keep the values in the zip64 record
+                zip64 = 0xFFFFFFFF in (size, offset)
+                if pos + _eocd.size + comment_len <= len(tail) and (zip64 or size + offset <= tail_offset + pos):
+                    if pos + _eocd.size + comment_len == len(tail):
+                        return pos
+                    if fallback < 0:
+                        fallback = pos
+            pos = tail.rfind(b'PK\x05\x06', 0, pos)
+        return fallback
+
+    def _end_record(self, fp):
+        # returns (member count, central directory size, central directory offset)
+        fp.seek(0, 2)
+        file_size = fp.tell()
+        tail_size = min(file_size, _eocd.size + _max_comment)
+        fp.seek(file_size - tail_size)
+        tail = fp.read()
+        eocd_pos = self._find_end_record(tail, file_size - tail_size)
+        if eocd_pos < 0:
+            raise zipfile.BadZipFile('File is not a zip file')
+        _, _, _, _, count, size, offset, _ = _eocd.unpack_from(tail, eocd_pos)
+        eocd_pos += file_size - tail_size
+
+        zip64 = False
+        locator_pos = eocd_pos - _eocd64_locator.size
+        if locator_pos >= 0:
+            fp.seek(locator_pos)
+            locator = fp.read(_eocd64_locator.size)
+            if locator[:4] == b'PK\x06\x07':
+                fp.seek(eocd_pos - _eocd64_locator.size - _eocd64.size)
+                record = fp.read(_eocd64.size)
+                if record[:4] == b'PK\x06\x06':
+                    _, _, _, _, _, _, _, count, size, offset = _eocd64.unpack(record)
+                    zip64 = True
+
+        # bytes prepended to the archive (e.g. a self-extractor) shift every offset
+        self._concat = eocd_pos - size - offset
+        if zip64:
+            self._concat -= _eocd64_locator.size + _eocd64.size
+        return count, size, self._concat + offset